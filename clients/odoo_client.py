@@ -1,11 +1,35 @@
 import time
+import asyncio
+import hashlib
+import itertools
+import json
 import logging
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import httpx
 
 logger = logging.getLogger(__name__)
 
+# Dispatcher exposed by custom-model-webhook (controllers/main.py)
+BATCH_PATH = "/webhook/rpc/batch"
+
+# (model, method[, args[, kwargs]])
+BatchCall = Sequence[Any]
+
+_rpc_ids = itertools.count(1)
+
+# call_kw methods without side effects; only these may share an in-flight call
+READ_ONLY_METHODS = frozenset({
+    "search",
+    "search_read",
+    "search_count",
+    "read",
+    "read_group",
+    "name_get",
+    "name_search",
+    "fields_get",
+})
+
 
 class OdooError(RuntimeError):
     """Raised when Odoo returns an application-level error."""
@@ -15,6 +39,134 @@ class OdooError(RuntimeError):
         self.data = data or {}
 
 
+def _build_headers(user_agent: Optional[str], extra_headers: Optional[Dict[str, str]]) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if user_agent:
+        headers["User-Agent"] = user_agent
+    if extra_headers:
+        headers.update(extra_headers)
+    return headers
+
+
+def _check_rpc_error(data: Any) -> Any:
+    """Raise OdooError when the JSON-RPC envelope carries an "error"."""
+    if isinstance(data, dict) and "error" in data:
+        err = data["error"]
+        # Odoo error format: {'code': ..., 'message': ..., 'data': {...}}
+        raise OdooError(
+            err.get("message", "Odoo RPC error"),
+            code=str(err.get("code", "")),
+            data=err.get("data") or {},
+        )
+    return data
+
+
+def _unwrap_result(data: Any) -> Any:
+    # Standard envelope: {'jsonrpc':'2.0','id':1,'result':...}
+    if isinstance(data, dict) and "result" in data:
+        return data["result"]
+    # Some endpoints (mis)respond without envelope; return raw
+    return data
+
+
+def _next_rpc_id() -> int:
+    return next(_rpc_ids)
+
+
+def _call_kw_payload(model: str, method: str, args: Optional[List[Any]], kwargs: Optional[Dict[str, Any]]) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "method": "call",
+        "params": {
+            "model": model,
+            "method": method,
+            "args": args or [],
+            "kwargs": kwargs or {},
+        },
+        "id": _next_rpc_id(),
+    }
+
+
+def _coalesce_key(scope: str, model: str, method: str, args: Optional[List[Any]], kwargs: Optional[Dict[str, Any]]) -> str:
+    # نفس الاستدعاء بترتيب مفاتيح مختلف يعطي نفس المفتاح
+    raw = json.dumps([scope, model, method, args or [], kwargs or {}], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _batch_payload(calls: Sequence[BatchCall]) -> dict:
+    items = []
+    for call in calls:
+        model, method, *rest = call
+        args = rest[0] if len(rest) > 0 else None
+        kwargs = rest[1] if len(rest) > 1 else None
+        items.append({"model": model, "method": method, "args": args or [], "kwargs": kwargs or {}})
+    return {
+        "jsonrpc": "2.0",
+        "method": "call",
+        "params": {"calls": items},
+        "id": _next_rpc_id(),
+    }
+
+
+def _unpack_batch(results: Any, expected: int) -> List[Any]:
+    """Turn the dispatcher's per-call envelopes into results or OdooError instances."""
+    if not isinstance(results, list) or len(results) != expected:
+        raise OdooError("Malformed batch response from Odoo")
+    out: List[Any] = []
+    for item in results:
+        if isinstance(item, dict) and item.get("error"):
+            err = item["error"]
+            out.append(OdooError(
+                err.get("message", "Odoo RPC error"),
+                code=str(err.get("code", "")),
+                data=err.get("data") or {},
+            ))
+        elif isinstance(item, dict):
+            out.append(item.get("result"))
+        else:
+            out.append(item)
+    return out
+
+
+def _search_kwargs(*, limit: Optional[int], offset: int, order: Optional[str]) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"offset": offset}
+    if limit is not None:
+        kwargs["limit"] = limit
+    if order:
+        kwargs["order"] = order
+    return kwargs
+
+
+def _summarize_updates(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    last_at = rows[0].get("timestamp") if rows else None
+    tally: Dict[str, int] = {}
+    for r in rows:
+        m = r.get("model") or "?"
+        tally[m] = tally.get(m, 0) + 1
+    summary = [{"model": m, "count": c} for m, c in tally.items()]
+    return {"last_update_at": last_at, "summary": summary, "events": rows}
+
+
+def _summary_group_args(since: Optional[str]) -> Tuple[list, dict]:
+    domain: List = []
+    if since:
+        domain.append(["timestamp", ">=", since])
+    # GROUP BY model with COUNT(*) and MAX(timestamp), computed by PostgreSQL
+    return [domain, ["timestamp:max"], ["model"]], {"lazy": False}
+
+
+def _summarize_groups(groups: List[Dict[str, Any]]) -> Dict[str, Any]:
+    summary = []
+    last_at: Optional[str] = None
+    for g in groups:
+        summary.append({"model": g.get("model") or "?", "count": int(g.get("__count", 0))})
+        ts = g.get("timestamp")
+        if ts and (last_at is None or ts > last_at):
+            last_at = ts
+    summary.sort(key=lambda item: item["count"], reverse=True)
+    return {"last_update_at": last_at, "summary": summary}
+
+
 class OdooClient:
     """Lightweight Odoo client using session-based auth.
 
@@ -41,19 +193,13 @@ class OdooClient:
         self.retries = max(0, int(retries))
         self.backoff = max(0.0, float(backoff))
 
-        headers = {"Content-Type": "application/json"}
-        if user_agent:
-            headers["User-Agent"] = user_agent
-        if extra_headers:
-            headers.update(extra_headers)
-
         cookies = {}
         if session_id:
             cookies["session_id"] = session_id
 
         self._client = httpx.Client(
             timeout=timeout,
-            headers=headers,
+            headers=_build_headers(user_agent, extra_headers),
             cookies=cookies,
             transport=transport,
         )
@@ -68,17 +214,8 @@ class OdooClient:
             try:
                 resp = self._client.post(url, json=payload)
                 resp.raise_for_status()
-                data = resp.json()
                 # Standard JSON-RPC envelope may include "error"
-                if isinstance(data, dict) and "error" in data:
-                    err = data["error"]
-                    # Odoo error format: {'code': ..., 'message': ..., 'data': {...}}
-                    raise OdooError(
-                        err.get("message", "Odoo RPC error"),
-                        code=str(err.get("code", "")),
-                        data=err.get("data") or {},
-                    )
-                return data
+                return _check_rpc_error(resp.json())
             except (httpx.HTTPError, ValueError) as exc:
                 last_exc = exc
                 if attempt < self.retries:
@@ -101,14 +238,10 @@ class OdooClient:
             "jsonrpc": "2.0",
             "method": "call",
             "params": {"service": service, "method": method, "args": args, "kwargs": kwargs or {}},
-            "id": 1,
+            "id": _next_rpc_id(),
         }
-        data = self._post_json("/jsonrpc", payload)
         # Successful JSON-RPC responses carry "result"
-        if isinstance(data, dict) and "result" in data:
-            return data["result"]
-        # Some endpoints (mis)respond without envelope; return raw
-        return data
+        return _unwrap_result(self._post_json("/jsonrpc", payload))
 
     # -----------------------------
     # call_kw (preferred for session cookie)
@@ -118,44 +251,57 @@ class OdooClient:
 
         This requires a valid session cookie established on this client.
         """
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": model,
-                "method": method,
-                "args": args or [],
-                "kwargs": kwargs or {},
-            },
-            "id": 1,
-        }
-        data = self._post_json("/web/dataset/call_kw", payload)
-        # Standard envelope: {'jsonrpc':'2.0','id':1,'result':...}
-        if isinstance(data, dict) and "result" in data:
-            return data["result"]
-        return data
+        data = self._post_json("/web/dataset/call_kw", _call_kw_payload(model, method, args, kwargs))
+        return _unwrap_result(data)
+
+    def call_kw_many(self, calls: Sequence[BatchCall]) -> List[Any]:
+        """Ship several call_kw invocations in one HTTP request.
+
+        Each call is a ``(model, method[, args[, kwargs]])`` tuple. Results come
+        back in order; a call that failed on the Odoo side yields an OdooError
+        instance in its slot instead of raising, so the others are still usable.
+        """
+        if not calls:
+            return []
+        data = self._post_json(BATCH_PATH, _batch_payload(calls))
+        return _unpack_batch(_unwrap_result(data), len(calls))
 
     # -----------------------------
     # High-level convenience APIs
     # -----------------------------
+    def get_session_info(self) -> Dict[str, Any]:
+        """uid, companies and context of the session; raises OdooError when it is invalid."""
+        data = self._post_json(
+            "/web/session/get_session_info",
+            {"jsonrpc": "2.0", "method": "call", "params": {}, "id": _next_rpc_id()}
+        )
+        info = _unwrap_result(data)
+        if not isinstance(info, dict) or not info.get("uid"):
+            raise OdooError("Session expired", code="SESSION_EXPIRED")
+        return info
+
+    def authenticate(self, db: str, login: str, password: str) -> Dict[str, Any]:
+        """Log in with credentials; the new session cookie is kept for later calls."""
+        data = self._post_json(
+            "/web/session/authenticate",
+            {"jsonrpc": "2.0", "method": "call", "params": {"db": db, "login": login, "password": password}, "id": _next_rpc_id()}
+        )
+        info = _unwrap_result(data)
+        if not isinstance(info, dict) or not info.get("uid"):
+            raise OdooError("Authentication failed", code="AUTH_FAILED")
+        return info
+
     def is_session_valid(self) -> bool:
         """Check if the session is valid by calling a light endpoint."""
         try:
             # /web/session/get_session_info returns info when session is valid
-            data = self._post_json(
-                "/web/session/get_session_info",
-                {"jsonrpc": "2.0", "method": "call", "params": {}, "id": 1}
-            )
-            return isinstance(data, dict) and data.get("result") is not None
+            self.get_session_info()
+            return True
         except Exception:
             return False
 
     def search(self, model: str, domain: List, *, limit: Optional[int] = None, offset: int = 0, order: Optional[str] = None) -> List[int]:
-        kwargs: Dict[str, Any] = {"offset": offset}
-        if limit is not None:
-            kwargs["limit"] = limit
-        if order:
-            kwargs["order"] = order
+        kwargs = _search_kwargs(limit=limit, offset=offset, order=order)
         return self.call_kw(model, "search", [domain], kwargs)
 
     def read(self, model: str, ids: List[int], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
@@ -175,13 +321,9 @@ class OdooClient:
         order: Optional[str] = None,
         context: Optional[Dict[str, Any]] = None,
     ) -> List[Dict[str, Any]]:
-        kwargs: Dict[str, Any] = {"offset": offset}
+        kwargs = _search_kwargs(limit=limit, offset=offset, order=order)
         if fields:
             kwargs["fields"] = fields
-        if limit is not None:
-            kwargs["limit"] = limit
-        if order:
-            kwargs["order"] = order
         if context:
             kwargs["context"] = context
         return self.call_kw(model, "search_read", [domain], kwargs)
@@ -219,16 +361,17 @@ class OdooClient:
             limit=limit,
             order="timestamp desc",  # هنا أيضًا
         )
-        last_at = rows[0].get("timestamp") if rows else None  # هنا أيضًا
-        tally: Dict[str, int] = {}
-        for r in rows:
-            m = r.get("model") or "?"
-            tally[m] = tally.get(m, 0) + 1
-        summary = [{"model": m, "count": c} for m, c in tally.items()]
-        return {"last_update_at": last_at, "summary": summary, "events": rows}
+        return _summarize_updates(rows)
+
+    def count_updates_by_model(self, *, since: Optional[str] = None) -> Dict[str, Any]:
+        """Per-model counts and latest timestamp via read_group (no row limit, no rows on the wire)."""
+        args, kwargs = _summary_group_args(since)
+        return _summarize_groups(self.call_kw("update.webhook", "read_group", args, kwargs))
 
     # --- inside OdooClient.cleanup_updates ---
-    def cleanup_updates(self, *, before: Optional[str] = None) -> int:
+    def cleanup_updates(self, *, before: Optional[str] = None, all_events: bool = False) -> int:
+        if not before and not all_events:
+            raise ValueError("cleanup requires before, or all_events=True to delete every event")
         domain: List = []
         if before:
             domain.append(["timestamp", "<=", before])  # بدل occurred_at → timestamp
@@ -237,6 +380,23 @@ class OdooClient:
             return 0
         return int(self.call_kw("update.webhook", "unlink", [ids])) or 0
 
+    def cleanup_updates_chunk(
+        self,
+        *,
+        before: Optional[str] = None,
+        all_events: bool = False,
+        batch_size: int = 1000,
+        max_batches: int = 10,
+    ) -> Dict[str, Any]:
+        """Bounded server-side delete; returns {'deleted': int, 'done': bool}.
+
+        Without before, all_events=True is required to empty the log.
+        """
+        return self.call_kw(
+            "update.webhook", "cleanup_before", [before],
+            {"batch_size": batch_size, "max_batches": max_batches, "all_events": all_events},
+        )
+
 
     # -----------------------------
     # Context manager
@@ -252,3 +412,258 @@ class OdooClient:
 
     def __exit__(self, exc_type, exc, tb) -> None:
         self.close()
+
+
+class AsyncOdooClient:
+    """Non-blocking twin of OdooClient built on httpx.AsyncClient.
+
+    Exposes the same API as OdooClient, but every RPC is a coroutine and the
+    retry backoff uses asyncio.sleep, so a slow Odoo call never pins a
+    threadpool slot of the ASGI server.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        session_id: Optional[str] = None,
+        *,
+        db: Optional[str] = None,
+        timeout: float = 15.0,
+        retries: int = 2,
+        backoff: float = 0.3,
+        extra_headers: Optional[Dict[str, str]] = None,
+        user_agent: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        coalescer: Optional[Any] = None,
+        coalesce_scope: Optional[str] = None,
+    ) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.db = db
+        self.retries = max(0, int(retries))
+        self.backoff = max(0.0, float(backoff))
+
+        # Identical concurrent read-only calls in the same authorization scope
+        # share one upstream request (core.singleflight.SingleFlight).
+        self._coalescer = coalescer
+        self._coalesce_scope = coalesce_scope
+        if coalescer is not None and coalesce_scope is None and session_id:
+            self._coalesce_scope = "s:" + hashlib.sha256(session_id.encode()).hexdigest()
+
+        cookies = {}
+        if session_id:
+            cookies["session_id"] = session_id
+
+        # A caller-supplied transport is a shared connection pool: this client
+        # only carries the session cookie and must not close the pool.
+        self._owns_transport = transport is None
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            headers=_build_headers(user_agent, extra_headers),
+            cookies=cookies,
+            transport=transport,
+            trust_env=self._owns_transport,
+        )
+
+    # -----------------------------
+    # Low-level HTTP with retries
+    # -----------------------------
+    async def _post_json(self, path: str, payload: dict) -> dict:
+        url = f"{self.base_url}{path}"
+        last_exc: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            try:
+                resp = await self._client.post(url, json=payload)
+                resp.raise_for_status()
+                return _check_rpc_error(resp.json())
+            except (httpx.HTTPError, ValueError) as exc:
+                last_exc = exc
+                if attempt < self.retries:
+                    sleep_for = self.backoff * (2 ** attempt)
+                    logger.warning(
+                        "POST %s failed (attempt %d/%d): %s; retrying in %.2fs",
+                        path, attempt + 1, self.retries + 1, exc, sleep_for
+                    )
+                    await asyncio.sleep(sleep_for)
+                else:
+                    break
+        assert last_exc is not None
+        raise last_exc
+
+    # -----------------------------
+    # JSON-RPC helpers (optional)
+    # -----------------------------
+    async def _jsonrpc(self, service: str, method: str, args: list, kwargs: Optional[dict] = None) -> Any:
+        payload = {
+            "jsonrpc": "2.0",
+            "method": "call",
+            "params": {"service": service, "method": method, "args": args, "kwargs": kwargs or {}},
+            "id": _next_rpc_id(),
+        }
+        return _unwrap_result(await self._post_json("/jsonrpc", payload))
+
+    # -----------------------------
+    # call_kw (preferred for session cookie)
+    # -----------------------------
+    async def call_kw(self, model: str, method: str, args: Optional[List[Any]] = None, kwargs: Optional[Dict[str, Any]] = None) -> Any:
+        """Call an Odoo model method via /web/dataset/call_kw.
+
+        Read-only methods are coalesced when the client has a coalescer:
+        callers get the shared result object and must not mutate it.
+        """
+        if self._coalescer is not None and self._coalesce_scope and method in READ_ONLY_METHODS:
+            key = _coalesce_key(self._coalesce_scope, model, method, args, kwargs)
+            return await self._coalescer.do(key, lambda: self._call_kw(model, method, args, kwargs))
+        return await self._call_kw(model, method, args, kwargs)
+
+    async def _call_kw(self, model: str, method: str, args: Optional[List[Any]], kwargs: Optional[Dict[str, Any]]) -> Any:
+        data = await self._post_json("/web/dataset/call_kw", _call_kw_payload(model, method, args, kwargs))
+        return _unwrap_result(data)
+
+    async def call_kw_many(self, calls: Sequence[BatchCall]) -> List[Any]:
+        """Batched call_kw, see OdooClient.call_kw_many."""
+        if not calls:
+            return []
+        data = await self._post_json(BATCH_PATH, _batch_payload(calls))
+        return _unpack_batch(_unwrap_result(data), len(calls))
+
+    # -----------------------------
+    # High-level convenience APIs
+    # -----------------------------
+    async def get_session_info(self) -> Dict[str, Any]:
+        """Async get_session_info, see OdooClient.get_session_info."""
+        data = await self._post_json(
+            "/web/session/get_session_info",
+            {"jsonrpc": "2.0", "method": "call", "params": {}, "id": _next_rpc_id()}
+        )
+        info = _unwrap_result(data)
+        if not isinstance(info, dict) or not info.get("uid"):
+            raise OdooError("Session expired", code="SESSION_EXPIRED")
+        return info
+
+    async def authenticate(self, db: str, login: str, password: str) -> Dict[str, Any]:
+        """Async authenticate, see OdooClient.authenticate."""
+        data = await self._post_json(
+            "/web/session/authenticate",
+            {"jsonrpc": "2.0", "method": "call", "params": {"db": db, "login": login, "password": password}, "id": _next_rpc_id()}
+        )
+        info = _unwrap_result(data)
+        if not isinstance(info, dict) or not info.get("uid"):
+            raise OdooError("Authentication failed", code="AUTH_FAILED")
+        return info
+
+    async def is_session_valid(self) -> bool:
+        """Check if the session is valid by calling a light endpoint."""
+        try:
+            await self.get_session_info()
+            return True
+        except Exception:
+            return False
+
+    async def search(self, model: str, domain: List, *, limit: Optional[int] = None, offset: int = 0, order: Optional[str] = None) -> List[int]:
+        kwargs = _search_kwargs(limit=limit, offset=offset, order=order)
+        return await self.call_kw(model, "search", [domain], kwargs)
+
+    async def read(self, model: str, ids: List[int], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        kwargs: Dict[str, Any] = {}
+        if fields:
+            kwargs["fields"] = fields
+        return await self.call_kw(model, "read", [ids], kwargs)
+
+    async def search_read(
+        self,
+        model: str,
+        domain: List,
+        fields: Optional[List[str]] = None,
+        *,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        order: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        kwargs = _search_kwargs(limit=limit, offset=offset, order=order)
+        if fields:
+            kwargs["fields"] = fields
+        if context:
+            kwargs["context"] = context
+        return await self.call_kw(model, "search_read", [domain], kwargs)
+
+    async def create(self, model: str, vals_list: Union[Dict[str, Any], List[Dict[str, Any]]]) -> Union[int, List[int]]:
+        return await self.call_kw(model, "create", [vals_list])
+
+    async def write(self, model: str, ids: List[int], vals: Dict[str, Any]) -> bool:
+        return bool(await self.call_kw(model, "write", [ids, vals]))
+
+    async def unlink(self, model: str, ids: List[int]) -> bool:
+        return bool(await self.call_kw(model, "unlink", [ids]))
+
+    async def name_get(self, model: str, ids: List[int]) -> List[Tuple[int, str]]:
+        return await self.call_kw(model, "name_get", [ids])
+
+    async def fields_get(self, model: str, attributes: Optional[List[str]] = None) -> Dict[str, Any]:
+        return await self.call_kw(model, "fields_get", [], {"attributes": attributes or []})
+
+    # -----------------------------
+    # Utilities for update.webhook
+    # -----------------------------
+    async def get_updates_summary(self, *, limit: int = 200, since: Optional[str] = None) -> Dict[str, Any]:
+        domain: List = []
+        if since:
+            domain.append(["timestamp", ">=", since])
+        rows = await self.search_read(
+            "update.webhook",
+            domain=domain,
+            fields=["model", "record_id", "event", "timestamp"],
+            limit=limit,
+            order="timestamp desc",
+        )
+        return _summarize_updates(rows)
+
+    async def count_updates_by_model(self, *, since: Optional[str] = None) -> Dict[str, Any]:
+        """Per-model counts and latest timestamp via read_group (no row limit, no rows on the wire)."""
+        args, kwargs = _summary_group_args(since)
+        return _summarize_groups(await self.call_kw("update.webhook", "read_group", args, kwargs))
+
+    async def cleanup_updates(self, *, before: Optional[str] = None, all_events: bool = False) -> int:
+        if not before and not all_events:
+            raise ValueError("cleanup requires before, or all_events=True to delete every event")
+        domain: List = []
+        if before:
+            domain.append(["timestamp", "<=", before])
+        ids = await self.call_kw("update.webhook", "search", [domain])
+        if not ids:
+            return 0
+        return int(await self.call_kw("update.webhook", "unlink", [ids])) or 0
+
+    async def cleanup_updates_chunk(
+        self,
+        *,
+        before: Optional[str] = None,
+        all_events: bool = False,
+        batch_size: int = 1000,
+        max_batches: int = 10,
+    ) -> Dict[str, Any]:
+        """Bounded server-side delete; returns {'deleted': int, 'done': bool}.
+
+        Without before, all_events=True is required to empty the log.
+        """
+        return await self.call_kw(
+            "update.webhook", "cleanup_before", [before],
+            {"batch_size": batch_size, "max_batches": max_batches, "all_events": all_events},
+        )
+
+    # -----------------------------
+    # Async context manager
+    # -----------------------------
+    async def aclose(self) -> None:
+        if not self._owns_transport:
+            return
+        try:
+            await self._client.aclose()
+        except Exception:
+            pass
+
+    async def __aenter__(self) -> "AsyncOdooClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
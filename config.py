@@ -7,6 +7,68 @@ load_dotenv()
 
 # Odoo API configuration
 ODOO_URL = os.getenv("ODOO_URL", "https://app.propanel.ma")
+# Gateway service account (local event replica, cursor flushes). The Odoo user
+# needs the group "Webhook Gateway Service" to persist buffered cursors.
+ODOO_DB = os.getenv("ODOO_DB", "")
+ODOO_USERNAME = os.getenv("ODOO_USERNAME", "")
+ODOO_PASSWORD = os.getenv("ODOO_PASSWORD", "")
+
+# Shared connection pool to Odoo (owned by the app lifespan in main.py)
+ODOO_POOL_MAX_CONNECTIONS = int(os.getenv("ODOO_POOL_MAX_CONNECTIONS", "200"))
+ODOO_POOL_MAX_KEEPALIVE = int(os.getenv("ODOO_POOL_MAX_KEEPALIVE", "50"))
+ODOO_POOL_KEEPALIVE_EXPIRY = float(os.getenv("ODOO_POOL_KEEPALIVE_EXPIRY", "30"))
+
+# Smart sync long-poll (/api/v2/sync/wait) and its shared event watcher
+SYNC_WAIT_DEFAULT_TIMEOUT = float(os.getenv("SYNC_WAIT_DEFAULT_TIMEOUT", "25"))
+SYNC_WAIT_MAX_TIMEOUT = float(os.getenv("SYNC_WAIT_MAX_TIMEOUT", "55"))
+EVENT_FEED_POLL_INTERVAL = float(os.getenv("EVENT_FEED_POLL_INTERVAL", "2"))
+EVENT_FEED_BUFFER_SIZE = int(os.getenv("EVENT_FEED_BUFFER_SIZE", "5000"))
+
+# Push ingest from the Odoo module (/api/v2/ingest). Empty token = disabled.
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+INGEST_MAX_EVENTS = int(os.getenv("INGEST_MAX_EVENTS", "1000"))
+EVENT_FEED_SAFETY_INTERVAL = float(os.getenv("EVENT_FEED_SAFETY_INTERVAL", "30"))
+
+# Live event stream (/api/v2/sync/stream, Server-Sent Events)
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "5000"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "1000"))
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+# Short-TTL response cache with ETag / 304 for read endpoints
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "5"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+# Per-worker cache of settled sync_pull event pages (same cursor → same page),
+# read by the worker owning the cursor buffer or by any worker with a fresh replica
+EVENT_PAGE_CACHE_MAX_PAGES = int(os.getenv("EVENT_PAGE_CACHE_MAX_PAGES", "1000"))
+
+# Write-behind buffer of sync cursors (0 = persist every pull synchronously)
+SYNC_CURSOR_FLUSH_INTERVAL = float(os.getenv("SYNC_CURSOR_FLUSH_INTERVAL", "2"))
+SYNC_CURSOR_FLUSH_BATCH = int(os.getenv("SYNC_CURSOR_FLUSH_BATCH", "500"))
+SYNC_CURSOR_MAX_ENTRIES = int(os.getenv("SYNC_CURSOR_MAX_ENTRIES", "50000"))
+# Only the worker holding this lock buffers cursors; the others write through.
+# With several hosts, route each device's pulls to one host (sticky sessions).
+SYNC_CURSOR_LOCK_PATH = os.getenv("SYNC_CURSOR_LOCK_PATH", "/tmp/odoo-webhook-cursors.lock")
+
+# Session validation cache (core.auth.get_session)
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_NEGATIVE_TTL = float(os.getenv("SESSION_CACHE_NEGATIVE_TTL", "10"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+# Session lookups that reach Odoo, per client IP and minute (NAT: many devices per IP)
+SESSION_LOOKUP_RATE_LIMIT = int(os.getenv("SESSION_LOOKUP_RATE_LIMIT", "120"))
+
+# Rate limiting backend shared by all workers: memory (single worker only),
+# mmap (every worker on one host) or redis (every replica)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "mmap")
+RATE_LIMIT_MMAP_PATH = os.getenv("RATE_LIMIT_MMAP_PATH", "/dev/shm/odoo-webhook-ratelimit")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+
+# Local SQLite replica of update.webhook (empty path = disabled); reads fall
+# back to Odoo when the replica has not caught up within REPLICA_MAX_LAG seconds
+REPLICA_PATH = os.getenv("REPLICA_PATH", "")
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+REPLICA_POLL_INTERVAL = float(os.getenv("REPLICA_POLL_INTERVAL", "1"))
+REPLICA_BATCH_SIZE = int(os.getenv("REPLICA_BATCH_SIZE", "1000"))
 
 # Logger setup
 logging.basicConfig(level=logging.INFO)
@@ -1,5 +1,16 @@
 # core/auth.py
-from fastapi import Header, Request, HTTPException
+import asyncio
+import hashlib
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import httpx
+from fastapi import Depends, Header, Request, HTTPException
+
+from clients.odoo_client import AsyncOdooClient, OdooError
+from core.cache import TTLCache
+from core.ratelimit import client_ip_key, get_rate_limiter
+from core.transport import get_odoo_transport
+from config import ODOO_URL, SESSION_LOOKUP_RATE_LIMIT
 
 HEADER_NAME = "X-Session-Id"
 COOKIE_NAME = "session_id"
@@ -20,3 +31,168 @@ def get_session_id(
     if len(sid) > 256:
         raise HTTPException(status_code=400, detail="INVALID_SESSION: too long")
     return sid
+
+
+# ==========================
+# Session → identity, validated once and cached
+# ==========================
+class SessionInfo(NamedTuple):
+    session_id: str
+    uid: int
+    company_ids: Tuple[int, ...]
+    db: str
+    # ACL على update.webhook؛ شرط لخدمة القراءات المشتركة (replica، feed)
+    can_read_events: bool = False
+
+    @property
+    def scope(self) -> str:
+        """Authorization scope: what Odoo's access rules see for this session."""
+        return f"{self.db}:{self.uid}:{','.join(map(str, self.company_ids))}"
+
+
+_INVALID = object()  # قيمة مخزنة للجلسات المرفوضة (negative cache)
+
+
+def _is_session_expired(error: OdooError) -> bool:
+    """Odoo rejected the session itself, as opposed to failing while answering."""
+    # 100 = SessionExpiredException في JSON-RPC؛ SESSION_EXPIRED = get_session_info بلا uid
+    if error.code in ("100", "SESSION_EXPIRED"):
+        return True
+    return str(error.data.get("name") or "").endswith("SessionExpiredException")
+
+
+def _session_key(session_id: str) -> str:
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+
+def _to_session_info(session_id: str, info: dict, can_read_events: bool = False) -> SessionInfo:
+    allowed = (info.get("user_companies") or {}).get("allowed_companies") or {}
+    return SessionInfo(
+        session_id=session_id,
+        uid=int(info["uid"]),
+        company_ids=tuple(sorted(int(cid) for cid in allowed)),
+        db=info.get("db") or "",
+        can_read_events=can_read_events,
+    )
+
+
+async def _can_read_events(client: AsyncOdooClient) -> bool:
+    """Whether Odoo's access rights let this session read update.webhook."""
+    try:
+        allowed = await client.call_kw(
+            "update.webhook", "check_access_rights", ["read"], {"raise_exception": False}
+        )
+    except OdooError:
+        # عند الشك لا نخدم من البيانات المشتركة (replica، feed)
+        return False
+    return bool(allowed)
+
+
+class SessionCache:
+    """Resolves a session id to its Odoo identity once per TTL.
+
+    The identity includes whether the session may read update.webhook,
+    checked at the same time, so replica-served reads honour Odoo's access
+    rights without a call per request.
+
+    Valid sessions are cached for ttl seconds and expired ones for
+    negative_ttl, so a logged-out device retrying in a loop is answered
+    with 401 without reaching Odoo. Any other Odoo error is raised and not
+    cached. Concurrent lookups of the same session share a single
+    get_session_info call.
+    """
+
+    def __init__(self, *, ttl: float = 60.0, negative_ttl: float = 10.0, max_entries: int = 10000) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(max_entries=max_entries)
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def resolve(self, session_id: str, transport: httpx.AsyncBaseTransport) -> Optional[SessionInfo]:
+        """SessionInfo for a valid session, None when Odoo rejects it."""
+        key = _session_key(session_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return None if cached is _INVALID else cached
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            info = await self._fetch(session_id, transport)
+            future.set_result(info)
+            return info
+        except BaseException as e:
+            future.set_exception(e)
+            # لا ننتظر من لا يقرأ النتيجة
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    async def _fetch(self, session_id: str, transport: httpx.AsyncBaseTransport) -> Optional[SessionInfo]:
+        client = AsyncOdooClient(
+            base_url=ODOO_URL,
+            session_id=session_id,
+            timeout=10,
+            retries=1,
+            backoff=0.3,
+            user_agent="WebhookServer/1.0",
+            transport=transport,
+        )
+        key = _session_key(session_id)
+        try:
+            session_info = await client.get_session_info()
+            info = _to_session_info(session_id, session_info, await _can_read_events(client))
+        except OdooError as e:
+            if not _is_session_expired(e):
+                # عطل في Odoo لا يعني أن الجلسة غير صالحة: 502 بدون تخزين
+                raise
+            self._cache.set(key, _INVALID, self.negative_ttl)
+            return None
+        finally:
+            await client.aclose()
+        self._cache.set(key, info, self.ttl)
+        return info
+
+    def is_cached(self, session_id: str) -> bool:
+        return self._cache.get(_session_key(session_id)) is not None
+
+    def forget(self, session_id: str) -> None:
+        self._cache.pop(_session_key(session_id))
+
+
+def get_session_cache(request: Request) -> SessionCache:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.session_cache
+
+
+async def get_session(
+    request: Request,
+    session_id: str = Depends(get_session_id),
+    sessions: SessionCache = Depends(get_session_cache),
+    transport: httpx.AsyncHTTPTransport = Depends(get_odoo_transport),
+) -> SessionInfo:
+    """Validated session: 401 at the edge for expired/invalid sessions.
+
+    Lookups that reach Odoo (session not cached yet) are limited per client
+    IP, so made-up session ids can't each cost an Odoo call. The validated
+    session is kept on request.state for core.ratelimit.rate_limit_key.
+    """
+    if not sessions.is_cached(session_id):
+        limiter = get_rate_limiter(request)
+        if not await limiter.hit("session_lookup", client_ip_key(request), limit=SESSION_LOOKUP_RATE_LIMIT, period=60):
+            raise HTTPException(status_code=429, detail="Too many session lookups, slow down.")
+    try:
+        info = await sessions.resolve(session_id, transport)
+    except OdooError as e:
+        raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+    except (httpx.HTTPError, ValueError) as e:
+        raise HTTPException(status_code=502, detail=f"Odoo unreachable: {e}") from e
+    if info is None:
+        raise HTTPException(status_code=401, detail="BAD_SESSION: expired or invalid session")
+    request.state.session = info
+    return info
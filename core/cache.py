@@ -0,0 +1,230 @@
+# core/cache.py
+import hashlib
+import json
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from starlette.requests import Request
+
+CacheKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+def _owner_key(session_id: str) -> str:
+    # لا نحتفظ بالـ session نفسه في الذاكرة
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+
+def make_etag(marker: Any, body: bytes) -> str:
+    """Strong ETag: the highest event id/timestamp plus a digest of the body."""
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return f'"{marker}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # If-None-Match يستخدم المقارنة الضعيفة (RFC 9110)
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class TTLCache:
+    """Small bounded LRU mapping with a per-entry time to live."""
+
+    def __init__(self, *, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self._entries.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        item = self._entries.pop(key, None)
+        return default if item is None else item[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    version: Any
+    expires_at: float
+
+
+class ResponseCache:
+    """Bounded LRU of rendered JSON responses with TTL eviction.
+
+    Entries are keyed by route scope, the caller's session (hashed) and the
+    normalized query parameters. An entry is also dropped as soon as the
+    version it was built at (the event feed's last change_seq) moves on.
+    """
+
+    def __init__(self, *, max_entries: int = 10000, ttl: float = 5.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._by_owner: Dict[Tuple[str, str], set] = {}  # (scope, owner) -> keys, for invalidate()
+
+    @staticmethod
+    def key(scope: str, session_id: str, params: Dict[str, Any]) -> CacheKey:
+        normalized = tuple(sorted((k, str(v)) for k, v in params.items() if v is not None))
+        return scope, _owner_key(session_id), normalized
+
+    def get(self, key: CacheKey, version: Any = None) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic() or entry.version != version:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: CacheKey, body: bytes, etag: str, version: Any = None) -> CachedResponse:
+        entry = CachedResponse(body, etag, version, time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._by_owner.setdefault(key[:2], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, scope: str, session_id: str) -> None:
+        for key in list(self._by_owner.get((scope, _owner_key(session_id)), ())):
+            self._drop(key)
+
+    def _drop(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+        keys = self._by_owner.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_owner[key[:2]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+PageKey = Tuple[Tuple[str, ...], Tuple[str, ...], int, int]
+
+
+class EventPageCache:
+    """Size-bounded LRU of sync_pull event pages shared by every device.
+
+    A page is identified by the model filters, the cursor it starts after
+    and the page size, so devices of one app_type that reach the same
+    cursor get the same page. Only full pages that end at or below Odoo's
+    settled watermark (update.webhook.get_settled_change_seq) are stored:
+    no lower change_seq can still commit inside the range, so the page
+    never changes again (compaction only ever removes superseded events
+    from it).
+
+    Pages are per worker and only read where the device's cursor is known
+    without asking Odoo: on the worker that owns the cursor buffer
+    (core.cursors.CursorBuffer.acquire_owner), or on any worker while the
+    local replica is fresh. Pages pulled from Odoo are therefore only
+    stored by the owner worker.
+    """
+
+    def __init__(self, *, max_pages: int = 1000) -> None:
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[PageKey, List[Dict[str, Any]]]" = OrderedDict()
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def key(
+        model_names: Optional[Iterable[str]],
+        models_filter: Optional[Iterable[str]],
+        after_seq: int,
+        limit: int,
+    ) -> PageKey:
+        return tuple(sorted(model_names or ())), tuple(sorted(models_filter or ())), after_seq, limit
+
+    def get(self, app_type: str, key: PageKey) -> Optional[List[Dict[str, Any]]]:
+        page = self._pages.get(key)
+        if page is None:
+            self.misses[app_type] += 1
+            return None
+        self._pages.move_to_end(key)
+        self.hits[app_type] += 1
+        return page
+
+    def put(self, key: PageKey, events: List[Dict[str, Any]], settled_seq: int) -> bool:
+        """Store a page if it is full and settled; returns whether it was stored."""
+        if len(events) < key[3]:
+            return False
+        if max(e["change_seq"] for e in events) > settled_seq:
+            return False
+        self._pages[key] = events
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return True
+
+    def clear(self) -> None:
+        self._pages.clear()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def stats(self) -> Dict[str, Any]:
+        app_types = sorted(set(self.hits) | set(self.misses))
+        return {
+            "pages": len(self._pages),
+            "max_pages": self.max_pages,
+            "by_app_type": {
+                app_type: {"hits": self.hits[app_type], "misses": self.misses[app_type]}
+                for app_type in app_types
+            },
+        }
+
+
+def get_event_page_cache(request: Request) -> EventPageCache:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.event_page_cache
+
+
+async def respond_cached(
+    request: Request,
+    cache: ResponseCache,
+    key: CacheKey,
+    build: Callable[[], Awaitable[Tuple[Any, Any]]],
+    *,
+    version: Any = None,
+) -> Response:
+    """Serve key from cache or build() -> (etag_marker, payload); 304 on If-None-Match."""
+    entry = cache.get(key, version)
+    if entry is None:
+        marker, payload = await build()
+        body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+        entry = cache.set(key, body, make_etag(marker, body), version)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def get_response_cache(request: Request) -> ResponseCache:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.response_cache
@@ -0,0 +1,289 @@
+# core/cursors.py
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from starlette.requests import Request
+
+from clients.odoo_client import AsyncOdooClient
+from config import ODOO_URL
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CursorKey = Tuple[int, str]  # (user_id, device_id)
+
+
+def _utcnow() -> str:
+    # نفس صيغة Odoo لحقول Datetime
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CursorBuffer:
+    """Write-behind buffer of user.sync.state cursors.
+
+    Pulls served by the gateway advance the device cursor in memory; a
+    background task persists the dirty ones with one
+    user.sync.state.sync_advance_many call per batch of batch_size, and the
+    last flush runs on shutdown. Every persisted row is a compare-and-set
+    from the value Odoo last held (base), so a reset or a pull handled by
+    another worker wins and the stale entry is dropped: the device then
+    re-reads its cursor from Odoo and may get a page again, never skip one.
+    A crash loses at most flush_interval seconds of cursor progress, with
+    the same outcome.
+
+    Every pull goes through the buffer: pulls Odoo answers itself
+    (sync_pull) are adopted afterwards, so the device's next pull finds its
+    cursor in memory. The buffer is only authoritative when it sees every
+    pull of a device, so one worker per host owns it (acquire_owner) and
+    the others persist each pull synchronously; behind a load balancer
+    with several workers or hosts, pulls must be sticky per device or the
+    compare-and-set keeps dropping entries (duplicate pages, never gaps).
+
+    Flushes run with the gateway service account only: sync_advance_many
+    writes every user's cursors and Odoo reserves it to the group Webhook
+    Gateway Service, so the buffer is disabled without credentials.
+    """
+
+    def __init__(
+        self,
+        *,
+        transport: httpx.AsyncBaseTransport,
+        credentials: Tuple[str, str, str],
+        flush_interval: float = 2.0,
+        batch_size: int = 500,
+        max_entries: int = 50000,
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+        self.horizon = 0  # آخر compaction horizon أعاده Odoo مع الـ flush
+
+        self._transport = transport
+        self._credentials = credentials
+        self._client: Optional[AsyncOdooClient] = None
+        self._entries: "OrderedDict[CursorKey, Dict[str, Any]]" = OrderedDict()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._owner_fd: Optional[int] = None
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def acquire_owner(self, path: str) -> bool:
+        """Claim the buffer for this worker; False when another worker on the host holds it."""
+        if self._owner_fd is not None or fcntl is None:
+            return True
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._owner_fd = fd
+        return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="cursor-flush")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("Final cursor flush failed, %d cursors not persisted: %s", self.pending, e)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._owner_fd is not None:
+            os.close(self._owner_fd)
+            self._owner_fd = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cursor flush failed, retrying: %s", e)
+                if self._client is not None:
+                    await self._client.aclose()
+                    self._client = None
+
+    # -----------------------------
+    # Cursors
+    # -----------------------------
+    @property
+    def pending(self) -> int:
+        return sum(1 for entry in self._entries.values() if entry["pulls"])
+
+    def get(self, user_id: int, device_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get((user_id, device_id))
+        if entry is not None:
+            self._entries.move_to_end((user_id, device_id))
+        return entry
+
+    def load(self, user_id: int, device_id: str, app_type: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Adopt a state read from Odoo (get_or_create_state) unless one is buffered."""
+        key = (user_id, device_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {
+                "user_id": user_id,
+                "device_id": device_id,
+                "app_type": app_type,
+                "base": state.get("last_event_id", 0),
+                "last_event_id": state.get("last_event_id", 0),
+                "last_sync_time": state.get("last_sync_time") or "",
+                "sync_count": state.get("sync_count", 0),
+                "is_active": state.get("is_active", True),
+                "pulls": 0,
+            }
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def advance(
+        self,
+        user_id: int,
+        device_id: str,
+        from_seq: int,
+        to_seq: int,
+    ) -> bool:
+        """In-memory compare-and-set of the cursor; persisted by the next flush."""
+        entry = self._entries.get((user_id, device_id))
+        if entry is None or entry["last_event_id"] != from_seq:
+            return False
+        entry["last_event_id"] = to_seq
+        entry["last_sync_time"] = _utcnow()
+        entry["sync_count"] += 1
+        entry["pulls"] += 1
+        return True
+
+    def drop(self, user_id: int, device_id: str) -> None:
+        """Forget a cursor (reset): pending progress is discarded."""
+        self._entries.pop((user_id, device_id), None)
+
+    async def settle(self, user_id: int, device_id: str) -> None:
+        """Persist one cursor before Odoo handles the device's pull itself; the entry is kept."""
+        entry = self._entries.get((user_id, device_id))
+        if entry is not None and entry["pulls"]:
+            await self._flush_batch([entry])
+
+    def adopt(self, user_id: int, device_id: str, app_type: str, result: Dict[str, Any]) -> None:
+        """Record the cursor Odoo's sync_pull just persisted, so the next pull needs no state read."""
+        # قيمة Odoo هي المرجع؛ تقدّم غير محفوظ أثناء الـ sync_pull يُلغى (تكرار لا فجوة)
+        previous = self._entries.pop((user_id, device_id), None)
+        self.load(user_id, device_id, app_type, {
+            "last_event_id": result.get("last_event_id", 0),
+            "last_sync_time": _utcnow(),
+            "sync_count": result.get("sync_count", previous["sync_count"] + 1 if previous else 0),
+            "is_active": previous["is_active"] if previous else True,
+        })
+
+    def _evict(self) -> None:
+        # نحذف الأقدم من الـ cursors المحفوظة فقط؛ غير المحفوظة تنتظر الـ flush
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        for key in [k for k, entry in self._entries.items() if not entry["pulls"]][:excess]:
+            del self._entries[key]
+
+    # -----------------------------
+    # Flushing to Odoo
+    # -----------------------------
+    async def _get_client(self) -> AsyncOdooClient:
+        # حساب الخدمة فقط: لا نستعير جلسة مستخدم لكتابة cursors الآخرين
+        if self._client is None:
+            client = AsyncOdooClient(
+                base_url=ODOO_URL,
+                timeout=15,
+                retries=1,
+                backoff=0.3,
+                user_agent="CursorBuffer/1.0",
+                transport=self._transport,
+            )
+            try:
+                await client.authenticate(*self._credentials)
+            except BaseException:
+                await client.aclose()
+                raise
+            self._client = client
+        return self._client
+
+    async def flush(self) -> int:
+        """Persist every dirty cursor; returns how many were applied."""
+        dirty = [entry for entry in self._entries.values() if entry["pulls"]]
+        applied = 0
+        for i in range(0, len(dirty), self.batch_size):
+            applied += await self._flush_batch(dirty[i:i + self.batch_size])
+        return applied
+
+    async def _flush_batch(self, entries: List[Dict[str, Any]]) -> int:
+        async with self._flush_lock:
+            # لقطة ثابتة: قد تتقدّم الـ cursors أثناء انتظار Odoo
+            batch = []
+            for entry in entries:
+                if not entry["pulls"]:
+                    continue
+                batch.append((entry, {
+                    "user_id": entry["user_id"],
+                    "device_id": entry["device_id"],
+                    "from_seq": entry["base"],
+                    "to_seq": entry["last_event_id"],
+                    "pulls": entry["pulls"],
+                    "synced_at": entry["last_sync_time"],
+                }))
+                entry["pulls"] = 0
+            if not batch:
+                return 0
+
+            try:
+                # داخل الـ try: فشل المصادقة يعيد التقدّم أيضًا
+                client = await self._get_client()
+                result = await client.call_kw(
+                    "user.sync.state", "sync_advance_many", [[row for _entry, row in batch]]
+                )
+            except BaseException:
+                # نعيد التقدّم غير المحفوظ للمحاولة التالية
+                for entry, row in batch:
+                    entry["pulls"] += row["pulls"]
+                raise
+
+        self.horizon = max(self.horizon, int(result.get("horizon") or 0))
+        applied = {tuple(pair) for pair in result.get("applied") or []}
+        for entry, row in batch:
+            key = (entry["user_id"], entry["device_id"])
+            if key in applied:
+                entry["base"] = row["to_seq"]
+            elif self._entries.get(key) is entry:
+                # Odoo تغيّر (reset أو worker آخر): نعيد القراءة منه في الـ pull التالي
+                del self._entries[key]
+        if len(applied) < len(batch):
+            logger.info("Dropped %d stale buffered cursors", len(batch) - len(applied))
+        return len(applied)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cursors": len(self._entries), "pending": self.pending, "horizon": self.horizon}
+
+
+def get_cursor_buffer(request: Request) -> Optional[CursorBuffer]:
+    # مُهيّأ في lifespan داخل main.py؛ None عندما يكون الـ write-behind معطّلًا
+    return getattr(request.app.state, "cursors", None)
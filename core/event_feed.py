@@ -0,0 +1,366 @@
+# core/event_feed.py
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from starlette.requests import Request
+
+from clients.odoo_client import AsyncOdooClient
+from config import ODOO_URL
+
+logger = logging.getLogger(__name__)
+
+FEED_FIELDS = ["id", "change_seq", "model", "record_id", "event", "timestamp"]
+
+
+class FeedSubscription:
+    """A live subscriber of the feed with its own bounded queue.
+
+    When the consumer falls behind and the queue fills up, the subscription
+    is flagged as overflowed and stops receiving events; the stream is then
+    expected to tell the client to resync from its last token.
+    """
+
+    def __init__(self, models: Optional[Iterable[str]] = None, *, queue_size: int = 1000) -> None:
+        self.models = set(models) if models else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.needs_resync = False
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        return self.models is None or event["model"] in self.models
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        if self.overflowed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventFeed:
+    """Single gateway-side watcher over update.webhook.
+
+    One background task polls Odoo for events newer than the highest
+    change_seq it has seen and keeps the most recent ones in a bounded
+    buffer. Parked long-poll requests and live stream subscribers are served
+    from the feed instead of each polling Odoo.
+
+    The gateway has no credentials of its own, so the watcher polls with the
+    session of one of the currently parked clients, and only while at least
+    one client is parked. When Odoo pushes events to /api/v2/ingest the
+    poll only runs at the slower safety interval to catch missed pushes.
+
+    A change_seq can commit after higher ones, so each poll re-reads from
+    Odoo's settled watermark (update.webhook.get_settled_change_seq) rather
+    than from the highest change_seq seen, and a waiter woken by an event
+    is held until Odoo's pulls can return it.
+    """
+
+    def __init__(
+        self,
+        *,
+        transport: httpx.AsyncBaseTransport,
+        poll_interval: float = 2.0,
+        buffer_size: int = 5000,
+        batch_size: int = 500,
+        safety_interval: Optional[float] = None,
+    ) -> None:
+        self._transport = transport
+        # مع الـ push من Odoo يصبح الـ polling شبكة أمان فقط
+        self.poll_interval = safety_interval or poll_interval
+        self.batch_size = batch_size
+
+        self.last_seq = 0
+        self._floor_seq = 0  # the buffer holds every event with change_seq > _floor_seq
+        self._polled_seq = 0  # every committed event up to here has been polled
+        self.settled_seq = 0
+        self.settle_seconds = 0.0
+        self._arrived: Dict[int, float] = {}  # change_seq -> loop time it reached the feed
+        self._primed = False
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._seqs: set = set()
+        self._cond = asyncio.Condition()
+
+        self._sessions: Dict[str, int] = {}  # session_id -> parked waiters / subscribers
+        self._subscribers: set = set()
+        self._has_waiters = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="event-feed")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # -----------------------------
+    # Upstream polling
+    # -----------------------------
+    def _client(self, session_id: str) -> AsyncOdooClient:
+        return AsyncOdooClient(
+            base_url=ODOO_URL,
+            session_id=session_id,
+            timeout=15,
+            retries=0,
+            user_agent="SmartSyncFeed/2.0",
+            transport=self._transport,
+        )
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_waiters.wait()
+            for session_id in list(self._sessions):
+                try:
+                    await self.poll_once(self._client(session_id))
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # جرّب جلسة عميل آخر منتظر
+                    logger.warning("Event feed poll failed: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _refresh_settled(self, client: AsyncOdooClient) -> int:
+        settle = await client.call_kw("update.webhook", "get_settled_change_seq", [])
+        self.settled_seq = max(self.settled_seq, int(settle.get("settled_seq") or 0))
+        self.settle_seconds = float(settle.get("settle_seconds") or 0)
+        return self.settled_seq
+
+    async def prime(self, client: AsyncOdooClient) -> None:
+        """Anchor the feed at the settled watermark; later events are polled."""
+        if self._primed:
+            return
+        settled_seq = await self._refresh_settled(client)
+        if self._primed:
+            return
+        self.last_seq = self._floor_seq = self._polled_seq = settled_seq
+        self._primed = True
+
+    async def poll_once(self, client: AsyncOdooClient) -> int:
+        """Fetch events above the settled watermark; returns how many were new."""
+        if not self._primed:
+            await self.prime(client)
+            return 0
+        # قبل القراءة: كل ما تحته مُلتزم، فلا نعيد قراءته في المرة القادمة
+        settled_seq = await self._refresh_settled(client)
+        after = self._polled_seq
+        published = 0
+        while True:
+            rows = await client.search_read(
+                "update.webhook",
+                domain=[("change_seq", ">", after), ("is_archived", "=", False)],
+                fields=FEED_FIELDS,
+                limit=self.batch_size,
+                order="change_seq asc",
+            )
+            published += await self.publish(rows)
+            if len(rows) < self.batch_size:
+                self._polled_seq = max(self._polled_seq, settled_seq)
+                return published
+            after = rows[-1]["change_seq"]
+
+    def _insert(self, event: Dict[str, Any]) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            evicted = self._buffer.popleft()
+            self._seqs.discard(evicted["change_seq"])
+            self._arrived.pop(evicted["change_seq"], None)
+            self._floor_seq = evicted["change_seq"]
+        if event["change_seq"] > self.last_seq:
+            self._buffer.append(event)
+            self.last_seq = event["change_seq"]
+        else:
+            # حدث متأخر (commit أبطأ من حدث أحدث): نضعه في مكانه
+            pos = len(self._buffer)
+            while pos and self._buffer[pos - 1]["change_seq"] > event["change_seq"]:
+                pos -= 1
+            self._buffer.insert(pos, event)
+        self._seqs.add(event["change_seq"])
+        self._arrived[event["change_seq"]] = asyncio.get_running_loop().time()
+
+    async def publish(self, events: List[Dict[str, Any]], *, pushed: bool = False) -> int:
+        """Add events to the buffer and fan them out.
+
+        Accepts both polled rows and events pushed by Odoo (/api/v2/ingest);
+        duplicates are ignored and late, lower change_seq values are slotted in order.
+        Returns how many events were new.
+        """
+        events = sorted(events, key=lambda e: e["change_seq"])
+        if pushed and not self._primed and events:
+            self.last_seq = self._floor_seq = self._polled_seq = events[0]["change_seq"] - 1
+            self._primed = True
+        fresh = []
+        for e in events:
+            if e["change_seq"] <= self._floor_seq or e["change_seq"] in self._seqs:
+                continue
+            self._insert(e)
+            fresh.append(e)
+        if not fresh:
+            return 0
+        for sub in self._subscribers:
+            for e in fresh:
+                sub.offer(e)
+        async with self._cond:
+            self._cond.notify_all()
+        return len(fresh)
+
+    # -----------------------------
+    # Sessions used for polling
+    # -----------------------------
+    def _retain(self, session_id: str) -> None:
+        self._sessions[session_id] = self._sessions.get(session_id, 0) + 1
+        self._has_waiters.set()
+
+    def _release(self, session_id: str) -> None:
+        self._sessions[session_id] -= 1
+        if not self._sessions[session_id]:
+            del self._sessions[session_id]
+        if not self._sessions:
+            self._has_waiters.clear()
+
+    # -----------------------------
+    # Live subscribers (fan-out)
+    # -----------------------------
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def subscribe(
+        self,
+        client: AsyncOdooClient,
+        session_id: str,
+        after_seq: int,
+        models: Optional[Iterable[str]] = None,
+        *,
+        queue_size: int = 1000,
+    ) -> FeedSubscription:
+        """Subscribe to new events, replaying buffered ones newer than after_seq.
+
+        Resuming is served from the buffer without touching Odoo; when
+        after_seq predates the buffer the subscription is flagged
+        needs_resync so the client pulls the gap once.
+        """
+        await self.prime(client)
+        sub = FeedSubscription(models, queue_size=queue_size)
+        if after_seq < self._floor_seq:
+            sub.needs_resync = True
+        else:
+            for e in self._buffer:
+                if e["change_seq"] > after_seq:
+                    sub.offer(e)
+        self._subscribers.add(sub)
+        self._retain(session_id)
+        return sub
+
+    def unsubscribe(self, sub: FeedSubscription, session_id: str) -> None:
+        if sub in self._subscribers:
+            self._subscribers.discard(sub)
+            self._release(session_id)
+
+    # -----------------------------
+    # Queries over the buffer
+    # -----------------------------
+    def has_events_after(self, after_seq: int, models: Optional[Iterable[str]] = None) -> Optional[bool]:
+        """True/False when the buffer can answer, None when after_seq predates it."""
+        if not self._primed or after_seq < self._floor_seq:
+            return None
+        if after_seq >= self.last_seq:
+            return False
+        wanted = set(models) if models else None
+        for e in reversed(self._buffer):
+            if e["change_seq"] <= after_seq:
+                break
+            if wanted is None or e["model"] in wanted:
+                return True
+        return False
+
+    def _settle_delay(self, after_seq: int, models: Optional[Iterable[str]] = None) -> float:
+        """Seconds until the first matching event after after_seq is below Odoo's settled watermark."""
+        wanted = set(models) if models else None
+        now = asyncio.get_running_loop().time()
+        delay = None
+        for e in reversed(self._buffer):
+            seq = e["change_seq"]
+            if seq <= after_seq:
+                break
+            if wanted is not None and e["model"] not in wanted:
+                continue
+            if seq <= self.settled_seq:
+                return 0.0
+            # سُحب قبل وصوله، فيستقر بعد settle_seconds من الوصول على الأكثر
+            remaining = self._arrived.get(seq, now) + self.settle_seconds - now
+            delay = remaining if delay is None else min(delay, remaining)
+        return max(0.0, delay or 0.0)
+
+    async def wait_for(
+        self,
+        client: AsyncOdooClient,
+        session_id: str,
+        after_seq: int,
+        models: Optional[Iterable[str]] = None,
+        *,
+        timeout: float,
+    ) -> bool:
+        """Wait until an event newer than after_seq exists for models, or timeout.
+
+        Returns once that event is also settled in Odoo, so the pull that
+        follows gets it instead of an empty page and another wait.
+        """
+        models = list(models) if models else None
+        await self.prime(client)
+        deadline = asyncio.get_running_loop().time() + timeout
+
+        found = self.has_events_after(after_seq, models)
+        if found is None:
+            # الـ token أقدم من الـ buffer: فحص مباشر واحد ثم ننتظر من حافة الـ buffer
+            domain: List = [("change_seq", ">", after_seq), ("is_archived", "=", False)]
+            if models:
+                domain.append(("model", "in", models))
+            if await client.search("update.webhook", domain=domain, limit=1):
+                return True
+            after_seq = max(after_seq, self._floor_seq)
+        elif found:
+            return await self._wait_settled(after_seq, models, deadline)
+
+        self._retain(session_id)
+        try:
+            async with self._cond:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.has_events_after(after_seq, models) is not False),
+                    timeout=timeout,
+                )
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._release(session_id)
+        if self.has_events_after(after_seq, models) is None:
+            return True
+        return await self._wait_settled(after_seq, models, deadline)
+
+    async def _wait_settled(self, after_seq: int, models: Optional[List[str]], deadline: float) -> bool:
+        remaining = deadline - asyncio.get_running_loop().time()
+        delay = self._settle_delay(after_seq, models)
+        if delay > remaining:
+            # لن يستقر قبل انتهاء المهلة: has_updates=false والعميل ينتظر مجددًا
+            await asyncio.sleep(max(0.0, remaining))
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+
+def get_event_feed(request: Request) -> EventFeed:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.event_feed
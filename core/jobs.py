@@ -0,0 +1,90 @@
+# core/jobs.py
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+
+def _owner_key(session_id: str) -> str:
+    # لا نحتفظ بالـ session نفسه في الذاكرة
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+
+class JobRegistry:
+    """In-memory registry of background jobs started by API calls.
+
+    Keeps the most recent max_jobs jobs; a job is only visible to the
+    session that started it. Running jobs are cancelled on shutdown.
+    """
+
+    def __init__(self, max_jobs: int = 100) -> None:
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(
+        self,
+        kind: str,
+        session_id: str,
+        func: Callable[[Dict[str, Any]], Awaitable[Any]],
+    ) -> Dict[str, Any]:
+        """Run func(progress) in the background; progress is a dict it may update."""
+        job_id = uuid.uuid4().hex
+        job: Dict[str, Any] = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "running",
+            "progress": {},
+            "result": None,
+            "error": None,
+            "started_at": time.time(),
+            "finished_at": None,
+            "_owner": _owner_key(session_id),
+        }
+        self._jobs[job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            old_id, _old = self._jobs.popitem(last=False)
+            task = self._tasks.pop(old_id, None)
+            if task:
+                task.cancel()
+        self._tasks[job_id] = asyncio.create_task(self._run(job, func), name=f"job-{kind}-{job_id}")
+        return job
+
+    async def _run(self, job: Dict[str, Any], func: Callable[[Dict[str, Any]], Awaitable[Any]]) -> None:
+        try:
+            job["result"] = await func(job["progress"])
+            job["status"] = "done"
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.warning("Background job %s failed: %s", job["job_id"], e)
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.time()
+            self._tasks.pop(job["job_id"], None)
+
+    def get(self, job_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None or job["_owner"] != _owner_key(session_id):
+            return None
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    async def shutdown(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_job_registry(request: Request) -> JobRegistry:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.jobs
@@ -0,0 +1,249 @@
+# core/ratelimit.py
+import asyncio
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, Optional, Protocol, Tuple
+
+from starlette.requests import Request
+
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _take(tokens: float, updated_at: float, now: float, limit: int, period: float) -> Tuple[bool, float]:
+    """Token bucket step: refill at limit/period per second, then take one token."""
+    tokens = min(float(limit), tokens + max(0.0, now - updated_at) * limit / period)
+    if tokens >= 1.0:
+        return True, tokens - 1.0
+    return False, tokens
+
+
+class RateLimitBackend(Protocol):
+    async def hit(self, bucket: str, limit: int, period: float) -> bool: ...
+
+
+class MemoryBackend:
+    """Per-process buckets; only correct with a single worker."""
+
+    def __init__(self, max_buckets: int = 100000) -> None:
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def hit(self, bucket: str, limit: int, period: float) -> bool:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(bucket, (float(limit), now))
+        allowed, tokens = _take(tokens, updated_at, now, limit, period)
+        if bucket not in self._buckets and len(self._buckets) >= self.max_buckets:
+            # أقدم bucket يُحذف (dict يحفظ ترتيب الإدخال)
+            self._buckets.pop(next(iter(self._buckets)))
+        self._buckets[bucket] = (tokens, now)
+        return allowed
+
+
+class SharedMemoryBackend:
+    """Token buckets in a memory-mapped file shared by every worker on the host.
+
+    The file is split into groups of SLOTS_PER_GROUP fixed-size slots; a
+    bucket hashes to one group, and an fcntl byte-range lock on that group
+    makes the read-modify-write atomic across processes. When a group is
+    full the least recently used slot is recycled.
+
+    The lock is taken without blocking: while another worker holds the
+    group, hit() yields to the event loop and retries, and gives up (the
+    limiter then allows the request) after LOCK_TIMEOUT seconds. The
+    section itself never awaits, so coroutines of one worker can't
+    interleave inside it.
+    """
+
+    SLOT = struct.Struct("<Qdd8x")  # key hash, tokens, updated_at (CLOCK_MONOTONIC)
+    SLOTS_PER_GROUP = 8
+    LOCK_TIMEOUT = 0.05
+
+    def __init__(self, path: str, groups: int = 8192) -> None:
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryBackend requires fcntl (POSIX)")
+        self.groups = groups
+        self._group_size = self.SLOT.size * self.SLOTS_PER_GROUP
+        size = self._group_size * groups
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+
+    @staticmethod
+    def _hash(bucket: str) -> int:
+        # 0 يعني slot فارغ
+        return int.from_bytes(hashlib.blake2b(bucket.encode(), digest_size=8).digest(), "little") or 1
+
+    async def _lock_group(self, start: int) -> None:
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        spins = 0
+        while True:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, self._group_size, start)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+            if time.monotonic() >= deadline:
+                raise TimeoutError("rate limit group is locked by another worker")
+            spins += 1
+            # أولًا نترك الدور فقط، ثم ننتظر قليلًا حتى لا ندور بلا فائدة
+            await asyncio.sleep(0 if spins < 10 else 0.001)
+
+    async def hit(self, bucket: str, limit: int, period: float) -> bool:
+        key = self._hash(bucket)
+        start = (key % self.groups) * self._group_size
+        await self._lock_group(start)
+        try:
+            now = time.monotonic()
+            slot_offset = None
+            oldest_offset, oldest_at = start, None
+            for i in range(self.SLOTS_PER_GROUP):
+                offset = start + i * self.SLOT.size
+                slot_key, tokens, updated_at = self.SLOT.unpack_from(self._mm, offset)
+                if slot_key == key:
+                    slot_offset = offset
+                    break
+                if slot_key == 0:
+                    oldest_offset, oldest_at = offset, float("-inf")
+                elif oldest_at is None or updated_at < oldest_at:
+                    oldest_offset, oldest_at = offset, updated_at
+            if slot_offset is None:
+                slot_offset, tokens, updated_at = oldest_offset, float(limit), now
+            allowed, tokens = _take(tokens, updated_at, now, limit, period)
+            self.SLOT.pack_into(self._mm, slot_offset, key, tokens, now)
+            return allowed
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self._group_size, start)
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+
+# Atomic token bucket; uses the server clock so every replica agrees
+_REDIS_TOKEN_BUCKET = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or limit
+local ts = tonumber(state[2]) or now
+tokens = math.min(limit, tokens + math.max(0, now - ts) * limit / period)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(period * 1000))
+return allowed
+"""
+
+
+class RedisBackend:
+    """Token buckets in Redis (or any server speaking its protocol), shared by all replicas.
+
+    client is a redis.asyncio-compatible object exposing eval(); a local
+    stand-in can be passed instead of a real connection.
+    """
+
+    def __init__(self, client: Any, prefix: str = "ratelimit:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> "RedisBackend":
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from e
+        return cls(redis_asyncio.Redis.from_url(url), **kwargs)
+
+    async def hit(self, bucket: str, limit: int, period: float) -> bool:
+        allowed = await self.client.eval(_REDIS_TOKEN_BUCKET, 1, self.prefix + bucket, limit, period)
+        return bool(int(allowed))
+
+    async def close(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+
+class RateLimiter:
+    """Per-route limits over a pluggable backend.
+
+    hit(name, key, limit=, period=) allows `limit` calls per `period`
+    seconds for each (route name, caller key), refilled continuously.
+    """
+
+    def __init__(self, backend: RateLimitBackend) -> None:
+        self.backend = backend
+
+    async def hit(self, name: str, key: str, *, limit: int, period: float) -> bool:
+        try:
+            return await self.backend.hit(f"{name}:{key}", limit, period)
+        except Exception as e:
+            # لا نُسقط الطلب إذا تعطل الـ store المشترك
+            logger.warning("Rate limit backend failed, allowing request: %s", e)
+            return True
+
+    async def close(self) -> None:
+        close = getattr(self.backend, "close", None)
+        if close is not None:
+            result = close()
+            if hasattr(result, "__await__"):
+                await result
+
+
+def create_rate_limiter(backend: str, *, mmap_path: Optional[str] = None, redis_url: Optional[str] = None) -> RateLimiter:
+    """Build the limiter selected by RATE_LIMIT_BACKEND (memory | mmap | redis)."""
+    if backend == "redis":
+        if not redis_url:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires RATE_LIMIT_REDIS_URL")
+        return RateLimiter(RedisBackend.from_url(redis_url))
+    if backend == "mmap":
+        try:
+            return RateLimiter(SharedMemoryBackend(mmap_path or "/dev/shm/odoo-webhook-ratelimit"))
+        except (OSError, RuntimeError) as e:
+            logger.warning("Shared-memory rate limiter unavailable (%s); falling back to per-process limits", e)
+            return RateLimiter(MemoryBackend())
+    if backend != "memory":
+        raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return RateLimiter(MemoryBackend())
+
+
+def rate_limit_key(request: Request) -> str:
+    """Caller identity for limits: the validated session (hashed), else the client IP.
+
+    Mobile carriers put many devices behind one NAT address, so the IP
+    alone would make unrelated users share a budget. The session id only
+    counts once core.auth.get_session has validated it: a client sending
+    a new random id per request would otherwise get a fresh budget each
+    time.
+    """
+    session = getattr(request.state, "session", None)
+    if session is not None:
+        return "s:" + hashlib.sha256(session.session_id.encode()).hexdigest()[:32]
+    return client_ip_key(request)
+
+
+def client_ip_key(request: Request) -> str:
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def get_rate_limiter(request: Request) -> RateLimiter:
+    # مُهيّأ في main.py
+    return request.app.state.limiter
@@ -0,0 +1,390 @@
+# core/replica.py
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from starlette.requests import Request
+
+from clients.odoo_client import AsyncOdooClient
+from config import ODOO_URL
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+REPLICA_FIELDS = ["id", "change_seq", "model", "record_id", "event", "timestamp"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    change_seq INTEGER PRIMARY KEY,
+    id         INTEGER NOT NULL UNIQUE,
+    model      TEXT    NOT NULL,
+    record_id  INTEGER NOT NULL,
+    event      TEXT    NOT NULL,
+    timestamp  TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_model_id ON events (model, id);
+CREATE INDEX IF NOT EXISTS events_model_seq ON events (model, change_seq);
+CREATE INDEX IF NOT EXISTS events_timestamp_id ON events (timestamp, id);
+CREATE INDEX IF NOT EXISTS events_record ON events (model, record_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _normalize_ts(value: str) -> str:
+    # Odoo يخزن "YYYY-MM-DD HH:MM:SS"؛ نقبل ISO مع T أيضًا
+    return value.replace("T", " ")[:19]
+
+
+class EventReplica:
+    """Local SQLite (WAL) copy of update.webhook for serving reads.
+
+    One worker per host holds the tail lock and follows Odoo by change_seq
+    with the gateway's service account; pushed events from /api/v2/ingest
+    are applied by whichever worker receives them. Readers only trust the
+    replica while the last successful catch-up is younger than max_lag
+    seconds, and fall back to Odoo otherwise.
+
+    A transaction can still commit a change_seq below rows already copied,
+    so each catch-up re-reads everything above Odoo's settled watermark
+    (update.webhook.get_settled_change_seq) and events_after never serves
+    past it.
+
+    Rows Odoo deletes or archives (compaction, the orphan cleanup cron,
+    /cleanup on another host, create superseding write) never show up in
+    the tail, so the tailing worker also walks the replica by id, one batch
+    per poll, and drops the rows Odoo no longer returns. Reads bypass
+    Odoo's access rights: callers check SessionInfo.can_read_events first.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        transport: Any,
+        db: str,
+        login: str,
+        password: str,
+        max_lag: float = 10.0,
+        poll_interval: float = 1.0,
+        batch_size: int = 1000,
+    ) -> None:
+        self.path = path
+        self.max_lag = max_lag
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._transport = transport
+        self._credentials = (db, login, password)
+
+        self._local = threading.local()
+        self._client: Optional[AsyncOdooClient] = None
+        self._lock_fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    # -----------------------------
+    # SQLite plumbing
+    # -----------------------------
+    def _conn(self) -> sqlite3.Connection:
+        # اتصال لكل thread؛ WAL يسمح بالقراءة أثناء الكتابة
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    async def _run_sql(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    def _meta(self, conn: sqlite3.Connection) -> Dict[str, str]:
+        return {row["key"]: row["value"] for row in conn.execute("SELECT key, value FROM meta")}
+
+    def _apply_sync(self, rows: List[Dict[str, Any]], meta: Optional[Dict[str, Any]] = None) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for row in rows:
+                if row["event"] == "create":
+                    # نفس قاعدة Odoo: create يلغي write السابق لنفس السجل
+                    conn.execute(
+                        "DELETE FROM events WHERE event = 'write' AND model = ? AND record_id = ? AND change_seq < ?",
+                        (row["model"], row["record_id"], row["change_seq"]),
+                    )
+                # REPLACE يحذف أيضًا النسخة القديمة من نفس الـ id (upsert أخذ change_seq جديدًا)
+                conn.execute(
+                    "INSERT OR REPLACE INTO events (change_seq, id, model, record_id, event, timestamp)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (row["change_seq"], row["id"], row["model"], row["record_id"], row["event"],
+                     _normalize_ts(row.get("timestamp") or "")),
+                )
+            for key, value in (meta or {}).items():
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    async def apply(self, rows: List[Dict[str, Any]]) -> None:
+        """Apply pushed or polled events; idempotent."""
+        if rows:
+            await self._run_sql(self._apply_sync, rows)
+
+    async def prune(self, before: Optional[str]) -> int:
+        """Mirror a /cleanup on the replica."""
+        def _prune() -> int:
+            conn = self._conn()
+            with conn:
+                if before:
+                    cur = conn.execute("DELETE FROM events WHERE timestamp <= ?", (_normalize_ts(before),))
+                else:
+                    cur = conn.execute("DELETE FROM events")
+                return cur.rowcount
+        return await self._run_sql(_prune)
+
+    # -----------------------------
+    # Tailing Odoo
+    # -----------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="event-replica")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _acquire_tail_lock(self) -> bool:
+        """Only one worker per host tails Odoo; the others just read."""
+        if self._lock_fd is not None:
+            return True
+        if fcntl is None:
+            return True
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _get_client(self) -> AsyncOdooClient:
+        if self._client is None:
+            client = AsyncOdooClient(
+                base_url=ODOO_URL,
+                timeout=15,
+                retries=1,
+                backoff=0.3,
+                user_agent="EventReplica/1.0",
+                transport=self._transport,
+            )
+            await client.authenticate(*self._credentials)
+            self._client = client
+        return self._client
+
+    async def _run(self) -> None:
+        while True:
+            if self._acquire_tail_lock():
+                try:
+                    await self.sync_once()
+                    await self.reconcile_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Event replica sync failed: %s", e)
+                    # جلسة جديدة في المحاولة التالية
+                    if self._client is not None:
+                        await self._client.aclose()
+                        self._client = None
+            await asyncio.sleep(self.poll_interval)
+
+    async def sync_once(self) -> int:
+        """Catch up with Odoo; returns how many rows were fetched."""
+        client = await self._get_client()
+        meta = await self._run_sql(lambda: self._meta(self._conn()))
+        tail_seq = int(meta.get("tail_seq", 0))
+        # يُقرأ قبل الأحداث: كل ما تحته مُلتزم ومرئي في القراءات التالية
+        settle = await client.call_kw("update.webhook", "get_settled_change_seq", [])
+        after = int(meta.get("settled_seq", 0))
+        settled_seq = max(after, int(settle.get("settled_seq") or 0))
+        fetched = 0
+        while True:
+            rows = await client.search_read(
+                "update.webhook",
+                domain=[("change_seq", ">", after), ("is_archived", "=", False)],
+                fields=REPLICA_FIELDS,
+                limit=self.batch_size,
+                order="change_seq asc",
+            )
+            fetched += len(rows)
+            if rows:
+                after = rows[-1]["change_seq"]
+                tail_seq = max(tail_seq, after)
+                await self._run_sql(self._apply_sync, rows, {"tail_seq": tail_seq})
+            if len(rows) < self.batch_size:
+                break
+        horizon = await client.call_kw("update.webhook", "get_compaction_horizon", [])
+        await self._run_sql(
+            self._apply_sync, [],
+            {"synced_at": time.time(), "horizon": int(horizon or 0), "settled_seq": settled_seq},
+        )
+        return fetched
+
+    async def reconcile_once(self) -> int:
+        """Drop one batch of replica rows that are gone or archived in Odoo; returns how many."""
+        client = await self._get_client()
+
+        def _batch() -> List[Tuple[int, int]]:
+            conn = self._conn()
+            after_id = int(self._meta(conn).get("reconcile_id", 0))
+            rows = conn.execute(
+                "SELECT id, change_seq FROM events WHERE id > ? ORDER BY id LIMIT ?", (after_id, self.batch_size)
+            ).fetchall()
+            return [(row["id"], row["change_seq"]) for row in rows]
+
+        batch = await self._run_sql(_batch)
+        live = set()
+        if batch:
+            live = set(await client.search(
+                "update.webhook",
+                domain=[("id", "in", [event_id for event_id, _seq in batch]), ("is_archived", "=", False)],
+            ))
+
+        def _drop() -> int:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                removed = 0
+                for event_id, change_seq in batch:
+                    if event_id in live:
+                        continue
+                    # change_seq تغيّر = upsert جديد وصل بعد القراءة: السطر حيّ
+                    removed += conn.execute(
+                        "DELETE FROM events WHERE id = ? AND change_seq = ?", (event_id, change_seq)
+                    ).rowcount
+                # دفعة ناقصة = نهاية الجدول: الجولة التالية تبدأ من جديد
+                next_id = batch[-1][0] if len(batch) == self.batch_size else 0
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('reconcile_id', ?)", (str(next_id),))
+                return removed
+
+        removed = await self._run_sql(_drop)
+        if removed:
+            logger.info("Dropped %d replica rows deleted or archived in Odoo", removed)
+        return removed
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    async def status(self) -> Dict[str, Any]:
+        meta = await self._run_sql(lambda: self._meta(self._conn()))
+        synced_at = float(meta.get("synced_at", 0))
+        return {
+            "tail_seq": int(meta.get("tail_seq", 0)),
+            "settled_seq": int(meta.get("settled_seq", 0)),
+            "horizon": int(meta.get("horizon", 0)),
+            "synced_at": synced_at,
+            "lag": time.time() - synced_at if synced_at else None,
+        }
+
+    async def is_fresh(self) -> bool:
+        """True when the replica caught up with Odoo within the last max_lag seconds."""
+        status = await self.status()
+        return status["lag"] is not None and status["lag"] <= self.max_lag
+
+    async def events_after(
+        self,
+        after_seq: int,
+        model_names: Optional[Iterable[str]] = None,
+        models_filter: Optional[Iterable[str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """Same selection as user.sync.state.sync_pull, ordered by change_seq, up to the settled watermark."""
+        sql = (
+            "SELECT id, change_seq, model, record_id, event, timestamp FROM events WHERE change_seq > ?"
+            " AND change_seq <= (SELECT COALESCE(MAX(CAST(value AS INTEGER)), 0) FROM meta WHERE key = 'settled_seq')"
+        )
+        params: List[Any] = [after_seq]
+        for models in (model_names, models_filter):
+            models = list(models or [])
+            if models:
+                sql += f" AND model IN ({','.join('?' * len(models))})"
+                params += models
+        sql += " ORDER BY change_seq LIMIT ?"
+        params.append(limit)
+        rows = await self._run_sql(lambda: self._conn().execute(sql, params).fetchall())
+        return [dict(row) for row in rows]
+
+    async def count_by_model(self, since: Optional[str] = None) -> Dict[str, Any]:
+        """Same shape as AsyncOdooClient.count_updates_by_model."""
+        sql = "SELECT model, COUNT(*) AS count, MAX(timestamp) AS last_at FROM events"
+        params: List[Any] = []
+        if since:
+            sql += " WHERE timestamp >= ?"
+            params.append(_normalize_ts(since))
+        sql += " GROUP BY model ORDER BY count DESC"
+        rows = await self._run_sql(lambda: self._conn().execute(sql, params).fetchall())
+        last_at = max((row["last_at"] for row in rows), default=None)
+        return {"last_update_at": last_at, "summary": [{"model": row["model"], "count": row["count"]} for row in rows]}
+
+    async def list_events(
+        self,
+        *,
+        model_name: Optional[str] = None,
+        record_id: Optional[int] = None,
+        event: Optional[str] = None,
+        since: Optional[str] = None,
+        before: Optional[Tuple[str, int]] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """Rows for /api/v1/webhook/events ordered by (timestamp, id) desc; before is the keyset cursor."""
+        sql = "SELECT id, model, record_id, event, timestamp FROM events WHERE 1 = 1"
+        params: List[Any] = []
+        if model_name:
+            sql += " AND model = ?"
+            params.append(model_name)
+        if record_id is not None:
+            sql += " AND record_id = ?"
+            params.append(record_id)
+        if event:
+            sql += " AND event = ?"
+            params.append(event)
+        if since:
+            sql += " AND timestamp >= ?"
+            params.append(_normalize_ts(since))
+        if before:
+            sql += " AND (timestamp, id) < (?, ?)"
+            params += [_normalize_ts(before[0]), before[1]]
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        rows = await self._run_sql(lambda: self._conn().execute(sql, params).fetchall())
+        return [dict(row) for row in rows]
+
+
+def get_replica(request: Request) -> Optional[EventReplica]:
+    # مُهيّأ في lifespan داخل main.py؛ None عندما لا يكون مفعّلًا
+    return getattr(request.app.state, "replica", None)
@@ -0,0 +1,50 @@
+# core/singleflight.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from starlette.requests import Request
+
+
+class SingleFlight:
+    """Shares one in-flight upstream call between identical concurrent callers.
+
+    The first caller for a key starts the call as a task; callers arriving
+    while it runs await the same task and get the same result (or
+    exception). Nothing is kept once the call finishes, so results are
+    never staler than a call of one's own. The task is shielded: a caller
+    that disconnects does not cancel the call for the others.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._pending.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._pending[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # لا تحذير "exception was never retrieved" إذا غادر كل المنتظرين
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._pending), "calls": self.calls, "coalesced": self.coalesced}
+
+
+def get_singleflight(request: Request) -> SingleFlight:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.singleflight
@@ -0,0 +1,24 @@
+# core/transport.py
+import httpx
+from starlette.requests import Request
+
+from config import (
+    ODOO_POOL_MAX_CONNECTIONS,
+    ODOO_POOL_MAX_KEEPALIVE,
+    ODOO_POOL_KEEPALIVE_EXPIRY,
+)
+
+
+def create_odoo_transport() -> httpx.AsyncHTTPTransport:
+    """Build the process-wide keep-alive pool used for every Odoo RPC."""
+    limits = httpx.Limits(
+        max_connections=ODOO_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=ODOO_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=ODOO_POOL_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncHTTPTransport(limits=limits)
+
+
+def get_odoo_transport(request: Request) -> httpx.AsyncHTTPTransport:
+    # مُهيّأ في lifespan داخل main.py
+    return request.app.state.odoo_transport
@@ -20,7 +20,9 @@
     'website': 'https://www.geniustep.com',
     'license': 'LGPL-3',
     'data': [
+        'security/webhook_security.xml',
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/update_webhook_views.xml',
         'views/webhook_menuitem.xml',
     ],
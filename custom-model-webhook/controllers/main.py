@@ -0,0 +1,41 @@
+from odoo import http # type: ignore
+from odoo.api import call_kw # type: ignore
+from odoo.http import request, serialize_exception # type: ignore
+from odoo.models import check_method_name # type: ignore
+import logging
+
+_logger = logging.getLogger(__name__)
+
+MAX_BATCH_CALLS = 50
+
+
+class WebhookRpcBatch(http.Controller):
+
+    @http.route('/webhook/rpc/batch', type='json', auth='user', methods=['POST'])
+    def call_kw_batch(self, calls=None):
+        """ تنفيذ عدة استدعاءات call_kw في طلب HTTP واحد
+
+        Each call runs in its own savepoint so a failing call is rolled back
+        and reported in its slot without aborting the rest of the batch.
+        """
+        calls = calls or []
+        if len(calls) > MAX_BATCH_CALLS:
+            raise ValueError(f"Too many calls in batch ({len(calls)} > {MAX_BATCH_CALLS})")
+
+        results = []
+        for call in calls:
+            try:
+                model = call['model']
+                method = call['method']
+                check_method_name(method)
+                with request.env.cr.savepoint():
+                    result = call_kw(request.env[model], method, call.get('args') or [], call.get('kwargs') or {})
+                results.append({'result': result})
+            except Exception as e:
+                _logger.warning(f"⚠️ Batched call {call.get('model')}.{call.get('method')} failed: {e}")
+                results.append({'error': {
+                    'code': 200,
+                    'message': "Odoo Server Error",
+                    'data': serialize_exception(e),
+                }})
+        return results
@@ -1,3 +1,4 @@
 from . import webhook
 from . import update
+from . import sync_state
 from . import list_model
\ No newline at end of file
@@ -20,6 +20,7 @@ class ProductCategory(models.Model):
 class ResPartner(models.Model):
     _name = 'res.partner'
     _inherit = ['res.partner', 'webhook.mixin']
+    _webhook_ignored_fields = ('partner_latitude', 'partner_longitude', 'date_localization')
 
 class AccountMove(models.Model):
     _name = 'account.move'
@@ -36,6 +37,7 @@ class HrExpense(models.Model):
 class StockPicking(models.Model):
     _name = 'stock.picking'
     _inherit = ['stock.picking', 'webhook.mixin']
+    _webhook_ignored_fields = ('printed',)
 
 class PurchaseOrder(models.Model):
     _name = 'purchase.order'
@@ -0,0 +1,326 @@
+from odoo import models, fields, api, _ # type: ignore
+from odoo.exceptions import AccessError # type: ignore
+from odoo.tools import SQL # type: ignore
+import bisect
+import logging
+
+_logger = logging.getLogger(__name__)
+
+SYNC_EVENT_FIELDS = ["id", "change_seq", "model", "record_id", "event", "timestamp"]
+# حساب خدمة الـ gateway (security/webhook_security.xml)
+SERVICE_GROUP = 'group_webhook_service'
+
+
+def _merge_ranges(ranges, change_seqs, floor):
+    """ دمج change_seq جديدة في مجموعة مجالات [lo, hi] مرتبة وغير متداخلة
+
+    Values at or below floor (the device cursor) are already covered by it
+    and are dropped, so the set only ever describes out-of-order acks.
+    """
+    merged = [[lo, hi] for lo, hi in (ranges or []) if hi > floor]
+    for seq in sorted(set(change_seqs)):
+        if seq > floor:
+            merged.append([seq, seq])
+    merged.sort()
+    result = []
+    for lo, hi in merged:
+        lo = max(lo, floor + 1)
+        if result and lo <= result[-1][1] + 1:
+            result[-1][1] = max(result[-1][1], hi)
+        else:
+            result.append([lo, hi])
+    return result
+
+
+def _in_ranges(ranges, change_seq):
+    if not ranges:
+        return False
+    i = bisect.bisect_right([lo for lo, _hi in ranges], change_seq) - 1
+    return i >= 0 and ranges[i][1] >= change_seq
+
+
+class UserSyncState(models.Model):
+    _name = "user.sync.state"
+    _description = "Smart Sync cursor per user/device"
+    _order = "last_sync_time desc"
+
+    user_id = fields.Many2one('res.users', string="User", required=True, index=True, ondelete='cascade')
+    device_id = fields.Char(string="Device ID", required=True, index=True)
+    app_type = fields.Char(string="App Type")
+    # آخر change_seq تمت مزامنته؛ bigint مثل update.webhook.change_seq
+    last_event_id = fields.Integer(string="Last Change Sequence", default=0, column_type=('int8', 'int8'))
+    last_sync_time = fields.Datetime(string="Last Sync Time")
+    sync_count = fields.Integer(string="Sync Count", default=0)
+    is_active = fields.Boolean(string="Active", default=True)
+    # أحداث فوق الـ cursor وصلت خارج الترتيب (stream): [[lo, hi], ...] من change_seq
+    acked_ranges = fields.Json(string="Acknowledged Ranges", copy=False)
+
+    _sql_constraints = [
+        ('unique_user_device',
+         'unique(user_id, device_id)',
+         'A sync state already exists for this user and device!')
+    ]
+
+    def _to_state_dict(self):
+        self.ensure_one()
+        return {
+            "id": self.id,
+            "last_event_id": self.last_event_id,
+            "last_sync_time": fields.Datetime.to_string(self.last_sync_time) or "",
+            "sync_count": self.sync_count,
+            "is_active": self.is_active,
+        }
+
+    @api.model
+    def _get_or_create(self, user_id, device_id, app_type):
+        state = self.search([
+            ('user_id', '=', user_id),
+            ('device_id', '=', device_id),
+        ], limit=1)
+        if not state:
+            state = self.create({
+                'user_id': user_id,
+                'device_id': device_id,
+                'app_type': app_type,
+            })
+        return state
+
+    @api.model
+    def get_or_create_state(self, user_id, device_id, app_type):
+        return self._get_or_create(user_id, device_id, app_type)._to_state_dict()
+
+    def _lock_for_update(self):
+        # 🔒 نقفل سطر الحالة حتى لا يتقدّم نفس الجهاز مرتين بالتوازي
+        self.ensure_one()
+        self.env.cr.execute("SELECT id FROM user_sync_state WHERE id = %s FOR UPDATE", (self.id,))
+        self.invalidate_recordset()
+        return self
+
+    def _advance(self, last_event_id):
+        """ الـ cursor هو watermark الجهاز: كل حدث change_seq <= له تمت مزامنته """
+        self.ensure_one()
+        vals = {
+            'last_event_id': last_event_id,
+            'last_sync_time': fields.Datetime.now(),
+            'sync_count': self.sync_count + 1,
+        }
+        if self.acked_ranges:
+            vals['acked_ranges'] = _merge_ranges(self.acked_ranges, [], last_event_id) or False
+        self.write(vals)
+
+    @api.model
+    def sync_advance(self, user_id, device_id, app_type, from_seq, to_seq, event_ids=None):
+        """ تقديم الـ cursor بعد أن قرأ الـ gateway الأحداث من نسخته المحلية
+
+        Compare-and-set: the cursor only moves when it is still at from_seq,
+        so two concurrent pulls of the same device can't both advance it.
+        A cursor below the compaction horizon is refused so that sync_pull
+        can answer with resync_required. event_ids is accepted for older
+        gateways and ignored: the cursor itself records what was synced.
+        """
+        state = self._get_or_create(user_id, device_id, app_type)._lock_for_update()
+        if state.last_event_id != from_seq or from_seq < self.env['update.webhook'].sudo().get_compaction_horizon():
+            return {"advanced": False, "last_event_id": state.last_event_id}
+        state._advance(to_seq)
+        return {"advanced": True, "last_event_id": to_seq}
+
+    @api.model
+    def ack_events(self, user_id, device_id, app_type, change_seqs):
+        """ تسجيل أحداث استلمها الجهاز خارج الترتيب (مثلًا عبر الـ stream)
+
+        The device cursor is not moved: events between it and an ack may
+        still be missing. Acks at or below the cursor are already covered;
+        the rest are merged into acked_ranges, which stays a handful of
+        ranges per device however many events are acknowledged.
+        """
+        state = self._get_or_create(user_id, device_id, app_type)._lock_for_update()
+        ranges = _merge_ranges(state.acked_ranges, change_seqs or [], state.last_event_id)
+        if ranges != (state.acked_ranges or []):
+            state.write({'acked_ranges': ranges or False})
+        return {"last_event_id": state.last_event_id, "acked_ranges": ranges}
+
+    @api.model
+    def _states_from(self, min_seq):
+        """ الأجهزة التي قد تكون زامنت change_seq >= min_seq: بحث واحد لدفعة كاملة """
+        return self.search(['|', ('last_event_id', '>=', min_seq), ('acked_ranges', '!=', False)])
+
+    def _has_synced(self, change_seq):
+        """ watermark أعلى من change_seq أو مجال يحتويه """
+        self.ensure_one()
+        return self.last_event_id >= change_seq or _in_ranges(self.acked_ranges, change_seq)
+
+    @api.model
+    def unsynced_devices(self, event_id):
+        """ الأجهزة النشطة التي لم تزامن الحدث event_id بعد
+
+        Answered from the per-device watermarks and ack ranges only: one
+        scan of user.sync.state (O(devices)), nothing stored per event.
+        Devices are not filtered by app type here; the gateway knows which
+        models each app type follows. Only the gateway service account and
+        administrators see every user's devices; other callers get their
+        own.
+        """
+        self.env['update.webhook'].check_access_rights('read')
+        event = self.env['update.webhook'].sudo().browse(event_id).exists()
+        if not event:
+            return {"found": False, "devices": []}
+        seq = event.change_seq
+        domain = [('is_active', '=', True), ('last_event_id', '<', seq)]
+        if not (self._is_service() or self.env.user.has_group('base.group_system')):
+            domain.append(('user_id', '=', self.env.uid))
+        lagging = self.search(domain)
+        return {
+            "found": True,
+            "event_id": event.id,
+            "change_seq": seq,
+            "model": event.model,
+            "devices": [{
+                "user_id": state.user_id.id,
+                "device_id": state.device_id,
+                "app_type": state.app_type or "",
+                "last_event_id": state.last_event_id,
+                "last_sync_time": fields.Datetime.to_string(state.last_sync_time) or "",
+            } for state in lagging if not _in_ranges(state.acked_ranges, seq)],
+        }
+
+    def _is_service(self):
+        return self.env.user.has_group(f'{self._module}.{SERVICE_GROUP}')
+
+    @api.model
+    def sync_advance_many(self, entries):
+        """ حفظ دفعة من الـ cursors المخزنة مؤقتًا في الـ gateway بكتابة واحدة
+
+        Writes the cursors of every user, so it is reserved to the gateway
+        service account (group Webhook Gateway Service); see
+        _sync_advance_many.
+        """
+        if not self._is_service():
+            raise AccessError(_("Only the webhook gateway service account can persist buffered cursors."))
+        return self.sudo()._sync_advance_many(entries)
+
+    @api.model
+    def _sync_advance_many(self, entries):
+        """ entries: [{user_id, device_id, from_seq, to_seq, pulls, synced_at}]
+
+        Each row is a compare-and-set like sync_advance: it is only applied
+        while Odoo still holds from_seq and from_seq is not below the
+        compaction horizon. Returns the (user_id, device_id) pairs that were
+        applied and the current horizon.
+        """
+        webhooks = self.env['update.webhook'].sudo()
+        horizon = webhooks.get_compaction_horizon()
+        if not entries:
+            return {"applied": [], "horizon": horizon}
+
+        pairs = tuple({(e['user_id'], e['device_id']) for e in entries})
+        # 🔒 ترتيب ثابت للأقفال حتى لا تتعارض الدفعات المتوازية (deadlock)
+        self.env.cr.execute(SQL(
+            "SELECT id FROM user_sync_state WHERE (user_id, device_id) IN %s ORDER BY id FOR UPDATE",
+            pairs,
+        ))
+        self.env.cr.execute(SQL(
+            """
+            UPDATE user_sync_state s
+               SET last_event_id = v.to_seq,
+                   last_sync_time = v.synced_at,
+                   sync_count = s.sync_count + v.pulls,
+                   write_uid = %s,
+                   write_date = (now() at time zone 'UTC')
+              FROM (VALUES %s) AS v(user_id, device_id, from_seq, to_seq, pulls, synced_at)
+             WHERE s.user_id = v.user_id
+               AND s.device_id = v.device_id
+               AND s.last_event_id = v.from_seq
+               AND v.from_seq >= %s
+            RETURNING s.user_id, s.device_id
+            """,
+            self.env.uid,
+            SQL(", ").join(
+                SQL("(%s::int, %s::varchar, %s::bigint, %s::bigint, %s::int, %s::timestamp)",
+                    e['user_id'], e['device_id'], e['from_seq'], e['to_seq'], e.get('pulls', 1),
+                    e.get('synced_at') or fields.Datetime.now())
+                for e in entries
+            ),
+            horizon,
+        ))
+        applied = {tuple(row) for row in self.env.cr.fetchall()}
+        self.invalidate_model()
+
+        if len(applied) < len(entries):
+            _logger.info(f"⚠️ {len(entries) - len(applied)} buffered cursors were stale and not applied.")
+        return {"applied": [list(pair) for pair in applied], "horizon": horizon}
+
+    @api.model
+    def sync_pull(self, user_id, device_id, app_type, model_names=None, models_filter=None, limit=100):
+        """ سحب الأحداث الجديدة وتحديث حالة المزامنة في معاملة واحدة
+
+        Replaces the gateway's get_or_create_state / search_read / write
+        round trips with a single call_kw; the advanced cursor is the
+        device's sync watermark. When the cursor is older than the
+        compaction horizon the log can no longer replay the gap:
+        resync_required is returned and the cursor moves to the current
+        head, which the client keeps after its full resync. Events above
+        the settled watermark are left for a later pull, so a transaction
+        still committing below them is never skipped.
+        """
+        state = self._get_or_create(user_id, device_id, app_type)._lock_for_update()
+
+        last_event_id = state.last_event_id
+        last_sync_time = fields.Datetime.to_string(state.last_sync_time) or ""
+
+        webhooks = self.env['update.webhook'].sudo()
+        settled_seq = webhooks.get_settled_change_seq()['settled_seq']
+        horizon = webhooks.get_compaction_horizon()
+        if last_event_id < horizon:
+            head = max(settled_seq, horizon)
+            state.write({
+                'last_event_id': head,
+                'last_sync_time': fields.Datetime.now(),
+                'sync_count': state.sync_count + 1,
+                'acked_ranges': False,
+            })
+            _logger.info(f"♻️ Cursor {last_event_id} of device {device_id} predates compaction, full resync required.")
+            return {
+                "has_updates": True,
+                "resync_required": True,
+                "events": [],
+                "last_event_id": head,
+                "last_sync_time": last_sync_time,
+                "sync_count": state.sync_count,
+            }
+
+        domain = [
+            ('change_seq', '>', last_event_id),
+            ('change_seq', '<=', settled_seq),
+            ('is_archived', '=', False),
+        ]
+        if model_names:
+            domain.append(('model', 'in', model_names))
+        if models_filter:
+            domain.append(('model', 'in', models_filter))
+
+        events = webhooks.search_read(domain, SYNC_EVENT_FIELDS, limit=limit, order='change_seq asc')
+        if not events:
+            return {
+                "has_updates": False,
+                "resync_required": False,
+                "events": [],
+                "last_event_id": last_event_id,
+                "last_sync_time": last_sync_time,
+                "sync_count": state.sync_count,
+            }
+
+        new_last_event_id = events[-1]['change_seq']
+        state._advance(new_last_event_id)
+
+        for e in events:
+            e['timestamp'] = fields.Datetime.to_string(e['timestamp']) or ""
+        return {
+            "has_updates": True,
+            "resync_required": False,
+            "events": events,
+            "from_event_id": last_event_id,
+            "last_event_id": new_last_event_id,
+            "last_sync_time": last_sync_time,
+            "sync_count": state.sync_count,
+            "settled_seq": settled_seq,
+        }
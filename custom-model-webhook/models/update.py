@@ -1,9 +1,141 @@
-from odoo import models, fields, api # type: ignore
+from odoo import models, fields, api, SUPERUSER_ID, _ # type: ignore
+from odoo.exceptions import UserError # type: ignore
+from odoo.modules.registry import Registry # type: ignore
+from odoo.tools import SQL # type: ignore
+from odoo.tools.sql import create_index, create_unique_index # type: ignore
 import logging
+import queue
+import threading
+import time
 from datetime import timedelta
 
+import requests
+
 _logger = logging.getLogger(__name__)
 
+# Push ingest towards the FastAPI gateway (POST /api/v2/ingest)
+GATEWAY_URL_PARAM = 'webhook.gateway_ingest_url'
+GATEWAY_TOKEN_PARAM = 'webhook.gateway_ingest_token'
+PUSH_FIELDS = ['id', 'change_seq', 'model', 'record_id', 'event', 'timestamp']
+PUSH_BATCH_SIZE = 500
+PUSH_TIMEOUT = 5
+PUSH_RETRY_WINDOW = timedelta(days=1)
+# One push worker per process: bounded queue, circuit breaker while the
+# gateway is unreachable (the retry cron redelivers what was dropped)
+PUSH_QUEUE_SIZE = 1000
+PUSH_BREAKER_THRESHOLD = 3
+PUSH_BREAKER_COOLDOWN = 60
+
+CLEANUP_CHUNK_SIZE = 1000
+
+# Compaction: below the retention watermark only the latest event per
+# (model, record_id) is kept; unlink tombstones live longer, and purging them
+# raises the horizon below which cursors must do a full resync.
+COMPACTION_RETENTION_PARAM = 'webhook.compaction_retention_days'
+TOMBSTONE_RETENTION_PARAM = 'webhook.tombstone_retention_days'
+COMPACTION_HORIZON_PARAM = 'webhook.compaction_horizon'
+COMPACTION_RETENTION_DAYS = 7
+TOMBSTONE_RETENTION_DAYS = 30
+
+# تسلسل رتيب لكل تغيير؛ الـ upsert يأخذ قيمة جديدة عند كل تحديث للحدث
+CHANGE_SEQ_SEQUENCE = 'update_webhook_change_seq'
+# change_seq is drawn again at COMMIT by a deferred constraint trigger and
+# stamped with the clock; a value drawn more than the settle delay ago can no
+# longer be overtaken by a slow commit, so readers that move cursors stop at
+# that watermark.
+RESEQUENCE_TRIGGER = 'update_webhook_resequence'
+SETTLE_SECONDS_PARAM = 'webhook.change_seq_settle_seconds'
+SETTLE_SECONDS = 5
+
+def _post_events(url, token, rows):
+    """ POST دفعة إلى /api/v2/ingest؛ لا يستخدم أي cursor """
+    try:
+        resp = requests.post(
+            url,
+            json={'events': rows},
+            headers={'X-Ingest-Token': token or ''},
+            timeout=PUSH_TIMEOUT,
+        )
+        resp.raise_for_status()
+        return True
+    except requests.RequestException as e:
+        _logger.warning(f"⚠️ Gateway push failed for {len(rows)} events, will retry: {e}")
+        return False
+
+
+class _GatewayPusher:
+    """ عامل واحد لكل process يرسل الأحداث المُلتزمة إلى الـ gateway
+
+    Committed transactions only enqueue (dbname, ids); a single daemon
+    thread drains the bounded queue. No database cursor is held during the
+    HTTP call: rows are read in one short transaction and is_pushed is set
+    in another. After PUSH_BREAKER_THRESHOLD consecutive failures the
+    breaker opens for PUSH_BREAKER_COOLDOWN seconds and new work is
+    dropped, as it is when the queue is full; events keep is_pushed=False
+    and the retry cron redelivers them.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=PUSH_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._failures = 0
+        self._open_until = 0.0
+
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self._failures = 0
+                self._open_until = 0.0
+                return
+            self._failures += 1
+            if self._failures >= PUSH_BREAKER_THRESHOLD:
+                self._open_until = time.monotonic() + PUSH_BREAKER_COOLDOWN
+
+    def submit(self, dbname, ids):
+        if self.is_open():
+            return
+        try:
+            self._queue.put_nowait((dbname, ids))
+        except queue.Full:
+            _logger.warning(f"⚠️ Gateway push queue full, {len(ids)} events left to the retry cron.")
+            return
+        with self._lock:
+            # الـ thread لا ينجو من fork عمّال Odoo؛ يُنشأ عند أول حاجة
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="webhook-gateway-push", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            dbname, ids = self._queue.get()
+            try:
+                if not self.is_open():
+                    self._push(dbname, ids)
+            except Exception as e:
+                _logger.warning(f"⚠️ Gateway push worker failed, cron will retry: {e}")
+
+    def _push(self, dbname, ids):
+        registry = Registry(dbname)
+        with registry.cursor() as cr:
+            webhooks = api.Environment(cr, SUPERUSER_ID, {})['update.webhook']
+            url, token = webhooks._get_gateway_config()
+            batches = webhooks.browse(ids).exists()._read_push_batches() if url else []
+        for rows in batches:
+            ok = _post_events(url, token, rows)
+            self.record(ok)
+            if not ok:
+                return
+            with registry.cursor() as cr:
+                api.Environment(cr, SUPERUSER_ID, {})['update.webhook']._mark_pushed(rows)
+
+
+_pusher = _GatewayPusher()
+
+
 class UpdateWebhook(models.Model):
     _name = "update.webhook"
     _description = "Store webhook updates from FastAPI"
@@ -23,6 +155,15 @@ class UpdateWebhook(models.Model):
         required=True,
         default=fields.Datetime.now,
     )
+    is_archived = fields.Boolean(string="Archived", default=False, index=True)
+    # مشتق من watermarks الأجهزة في user.sync.state بدل جدول user × event
+    synced_user_ids = fields.Many2many(
+        'res.users', string="Synced By Users", compute='_compute_synced_user_ids', store=False,
+    )
+    is_pushed = fields.Boolean(string="Pushed to Gateway", default=False, index=True, copy=False)
+    # bigint: يُسحب من التسلسل عند كل upsert وقبل كل commit
+    change_seq = fields.Integer(string="Change Sequence", readonly=True, copy=False, column_type=('int8', 'int8'))
+    change_at = fields.Datetime(string="Sequenced At", readonly=True, copy=False)
 
     _sql_constraints = [
         ('unique_event_per_record',
@@ -30,59 +171,435 @@ class UpdateWebhook(models.Model):
          'Duplicate webhook event for the same record is not allowed!')
     ]
 
+    def init(self):
+        """ تسلسل change_seq والفهارس المناسبة لمسارات القراءة
+
+        change_seq is seeded from id for existing rows so sync tokens issued
+        before the column existed stay valid. Indexes match the queries:
+        smart sync (model, change_seq) over live rows, the v1 listing by
+        (timestamp, id), per-model scans by (model, id) and the settled
+        watermark by change_at.
+
+        Every inserted row, and every upsert that draws a new change_seq,
+        queues a DEFERRABLE INITIALLY DEFERRED trigger that draws change_seq
+        again when the transaction runs COMMIT: unlike cr.precommit, which
+        Odoo also runs on each savepoint flush, nothing fires it earlier.
+        """
+        cr = self.env.cr
+        cr.execute(SQL("CREATE SEQUENCE IF NOT EXISTS %s", SQL.identifier(CHANGE_SEQ_SEQUENCE)))
+        cr.execute("UPDATE update_webhook SET change_seq = id WHERE change_seq IS NULL")
+        cr.execute("UPDATE update_webhook SET change_at = COALESCE(write_date, timestamp) WHERE change_at IS NULL")
+        # لا يرجع التسلسل إلى الخلف أبدًا
+        cr.execute(SQL(
+            """
+            SELECT setval(%s, GREATEST(
+                (SELECT COALESCE(MAX(change_seq), 0) FROM update_webhook),
+                (SELECT last_value FROM %s),
+                1
+            ), true)
+            """,
+            CHANGE_SEQ_SEQUENCE, SQL.identifier(CHANGE_SEQ_SEQUENCE),
+        ))
+        cr.execute(SQL(
+            "ALTER TABLE update_webhook ALTER COLUMN change_seq SET DEFAULT nextval(%s)",
+            CHANGE_SEQ_SEQUENCE,
+        ))
+        cr.execute(
+            "ALTER TABLE update_webhook ALTER COLUMN change_at SET DEFAULT (clock_timestamp() AT TIME ZONE 'UTC')"
+        )
+        create_unique_index(cr, 'update_webhook_change_seq_uniq', self._table, ['change_seq'])
+        cr.execute(SQL(
+            """
+            CREATE OR REPLACE FUNCTION %s() RETURNS trigger AS $$
+            BEGIN
+                UPDATE update_webhook
+                   SET change_seq = nextval(%s),
+                       change_at = (clock_timestamp() AT TIME ZONE 'UTC')
+                 WHERE id = NEW.id;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            SQL.identifier(RESEQUENCE_TRIGGER), CHANGE_SEQ_SEQUENCE,
+        ))
+        cr.execute(SQL(
+            "DROP TRIGGER IF EXISTS %s ON update_webhook", SQL.identifier(RESEQUENCE_TRIGGER),
+        ))
+        # WHEN يُقيَّم عند الحدث: تحديث الـ trigger نفسه (depth 1) لا يُعاد جدولته
+        cr.execute(SQL(
+            """
+            CREATE CONSTRAINT TRIGGER %s
+             AFTER INSERT OR UPDATE OF change_seq ON update_webhook
+             DEFERRABLE INITIALLY DEFERRED
+             FOR EACH ROW WHEN (pg_trigger_depth() = 0)
+             EXECUTE FUNCTION %s()
+            """,
+            SQL.identifier(RESEQUENCE_TRIGGER), SQL.identifier(RESEQUENCE_TRIGGER),
+        ))
+        create_index(cr, 'update_webhook_change_at_idx', self._table, ['change_at'])
+        # synced_user_ids كان علاقة مخزنة تنمو بعدد المستخدمين × الأحداث
+        cr.execute("DROP TABLE IF EXISTS res_users_update_webhook_rel")
+        cr.execute("DELETE FROM ir_model_relation WHERE name = 'res_users_update_webhook_rel'")
+        create_index(cr, 'update_webhook_model_id_idx', self._table, ['model', 'id'])
+        create_index(cr, 'update_webhook_timestamp_id_idx', self._table, ['timestamp', 'id'])
+        create_index(
+            cr, 'update_webhook_live_model_change_seq_idx', self._table, ['model', 'change_seq'],
+            where='is_archived = false',
+        )
+
     @api.model_create_multi
     def create(self, vals_list):
-        """ تطبيق القواعد عند إدخال سجل جديد في update.webhook """
+        """ تطبيق القواعد عند إدخال دفعة أحداث في update.webhook
+
+        Set-based: one lookup of the existing rows for the whole batch, one
+        delete of superseded writes and one INSERT .. ON CONFLICT upsert,
+        whatever the batch size.
+        - create: removes the record's existing write event
+        - write: ignored when a create for the record already exists
+        - duplicate (model, record_id, event): refreshes its timestamp
+        """
+        if not vals_list:
+            return self.browse()
+        try:
+            with self.env.cr.savepoint():
+                return self._upsert_events(vals_list)
+        except Exception as e:
+            self.env['webhook.errors'].create([{
+                'model': vals.get('model', 'unknown'),
+                'record_id': vals.get('record_id', 0),
+                'error_message': str(e),
+                'timestamp': fields.Datetime.now()
+            } for vals in vals_list])
+            _logger.error(f"❌ Error logging {len(vals_list)} webhook events: {e}")
+            return self.browse()
+
+    def _upsert_events(self, vals_list):
+        now = fields.Datetime.now()
+        # آخر قيمة لكل (model, record_id, event) داخل الدفعة
+        wanted = {}
         for vals in vals_list:
-            try:
-                existing_records = self.search([
-                    ('model', '=', vals['model']),
-                    ('record_id', '=', vals['record_id'])
-                ])
-
-                # 💥 تحقّق من وجود نفس السجل مسبقًا
-                same_record = self.search([
-                    ('model', '=', vals['model']),
-                    ('record_id', '=', vals['record_id']),
-                    ('event', '=', vals['event']),
-                ], limit=1)
-
-                if same_record:
-                    _logger.warning(f"⚠️ Skipping duplicate webhook for model={vals['model']} record_id={vals['record_id']} event={vals['event']}")
-                    continue
-
-                if existing_records:
-                    event_list = existing_records.mapped('event')
-                    latest_create = sorted(
-                        existing_records.filtered(lambda r: r.event == 'create'),
-                        key=lambda r: r.timestamp, reverse=True
-                    )
-                    latest_create = latest_create[0] if latest_create else None
-
-                    if vals['event'] == 'create':
-                        existing_writes = existing_records.filtered(lambda r: r.event == 'write')
-                        if existing_writes:
-                            existing_writes.unlink()
-                            _logger.info(f"🗑️ Removed existing Write events for record_id {vals['record_id']} after Create.")
-
-                    if 'create' in event_list and vals['event'] == 'write':
-                        _logger.info(f"⏳ Ignoring and removing Write for record_id {vals['record_id']} because Create already exists.")
-                        continue
-
-                # ✅ إنشاء السجل
-                record = super(UpdateWebhook, self).create([vals])
-                _logger.info(f"✅ Webhook event logged: {vals}")
-                return record
+            key = (vals['model'], vals['record_id'], vals['event'])
+            wanted[key] = vals.get('timestamp') or now
 
-            except Exception as e:
-                self.env['webhook.errors'].create({
-                    'model': vals.get('model', 'unknown'),
-                    'record_id': vals.get('record_id', 0),
-                    'error_message': str(e),
-                    'timestamp': fields.Datetime.now()
-                })
-                _logger.error(f"❌ Error logging webhook event: {e}")
+        pairs = tuple({(model, record_id) for model, record_id, _event in wanted})
+        self.env.cr.execute(SQL(
+            "SELECT model, record_id, event FROM update_webhook WHERE (model, record_id) IN %s",
+            pairs,
+        ))
+        existing = set(self.env.cr.fetchall())
+
+        created = {(m, r) for m, r, e in wanted if e == 'create'}
+        has_create = created | {(m, r) for m, r, e in existing if e == 'create'}
+        rows = []
+        for (model, record_id, event), timestamp in wanted.items():
+            if event == 'write' and (model, record_id) in has_create:
+                _logger.info(f"⏳ Ignoring Write for {model} record_id {record_id} because Create already exists.")
+                continue
+            rows.append((model, record_id, event, timestamp))
+
+        stale_writes = tuple((m, r) for m, r, e in existing if e == 'write' and (m, r) in created)
+        if stale_writes:
+            self.env.cr.execute(SQL(
+                "DELETE FROM update_webhook WHERE event = 'write' AND (model, record_id) IN %s",
+                stale_writes,
+            ))
+            _logger.info(f"🗑️ Removed {self.env.cr.rowcount} Write events superseded by Create.")
+
+        if not rows:
+            return self.browse()
+
+        uid = self.env.uid
+        self.env.cr.execute(SQL(
+            """
+            INSERT INTO update_webhook
+                (model, record_id, event, timestamp, is_archived, is_pushed,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES %s
+            ON CONFLICT ON CONSTRAINT update_webhook_unique_event_per_record
+            DO UPDATE SET timestamp = EXCLUDED.timestamp,
+                          change_seq = nextval(%s),
+                          change_at = (clock_timestamp() AT TIME ZONE 'UTC'),
+                          is_archived = FALSE,
+                          is_pushed = FALSE,
+                          write_uid = EXCLUDED.write_uid,
+                          write_date = EXCLUDED.write_date
+            RETURNING id
+            """,
+            SQL(", ").join(
+                SQL("(%s, %s, %s, %s, FALSE, FALSE, %s, %s, %s, %s)",
+                    model, record_id, event, timestamp, uid, now, uid, now)
+                for model, record_id, event, timestamp in rows
+            ),
+            CHANGE_SEQ_SEQUENCE,
+        ))
+        records = self.browse([row[0] for row in self.env.cr.fetchall()])
+        self.invalidate_model()
+        records._schedule_gateway_push()
+        _logger.info(f"✅ {len(records)} webhook events logged.")
+        return records
 
+    # -----------------------------
+    # Commit-ordered change_seq
+    # -----------------------------
+    @api.model
+    def get_settled_change_seq(self):
+        """ أعلى change_seq لا يمكن أن يظهر تحته حدث جديد بعد الآن
+
+        Every change_seq is drawn again by the deferred trigger during
+        COMMIT, so one drawn more than settle_seconds before this
+        transaction started belongs to a transaction that has committed
+        (and is visible here) or rolled back. Readers that move a cursor
+        (sync_pull, the gateway replica and feed) stop at settled_seq so
+        that a late commit never lands below a cursor that already passed
+        it. Only a COMMIT that itself takes longer than settle_seconds can
+        still be skipped; raise webhook.change_seq_settle_seconds where
+        that happens.
+        """
+        self.check_access_rights('read')
+        settle_seconds = int(self.env['ir.config_parameter'].sudo().get_param(SETTLE_SECONDS_PARAM, SETTLE_SECONDS))
+        # now() = بداية المعاملة: كل ما سُحب قبلها بـ settle_seconds مرئي في لقطتها
+        self.env.cr.execute(SQL(
+            """
+            SELECT change_seq FROM update_webhook
+             WHERE change_at <= (now() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+             ORDER BY change_at DESC LIMIT 1
+            """,
+            settle_seconds,
+        ))
+        row = self.env.cr.fetchone()
+        return {'settled_seq': row[0] if row else 0, 'settle_seconds': settle_seconds}
+
+    # -----------------------------
+    # Push to the gateway
+    # -----------------------------
+    def _get_gateway_config(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        return ICP.get_param(GATEWAY_URL_PARAM), ICP.get_param(GATEWAY_TOKEN_PARAM)
+
+    def _schedule_gateway_push(self):
+        """ إرسال أحداث المعاملة الحالية إلى الـ gateway بعد نجاح الـ commit """
+        url, _token = self._get_gateway_config()
+        if not url or not self:
+            return
+        pending = self.env.cr.postcommit.data.setdefault('webhook.push_ids', [])
+        if not pending:
+            dbname = self.env.cr.dbname
+            self.env.cr.postcommit.add(lambda: _pusher.submit(dbname, list(pending)))
+        pending.extend(self.ids)
+
+    def _read_push_batches(self):
+        """ صفوف الأحداث غير المرسلة مقسمة إلى دفعات PUSH_BATCH_SIZE """
+        records = self.filtered(lambda r: not r.is_pushed)
+        batches = []
+        for start in range(0, len(records), PUSH_BATCH_SIZE):
+            rows = records[start:start + PUSH_BATCH_SIZE].read(PUSH_FIELDS)
+            for row in rows:
+                row['timestamp'] = fields.Datetime.to_string(row['timestamp'])
+            batches.append(rows)
+        return batches
+
+    @api.model
+    def _mark_pushed(self, rows):
+        """ is_pushed فقط إذا لم يتغير الحدث منذ قراءته (upsert يعطيه change_seq جديدًا) """
+        if not rows:
+            return
+        self.env.cr.execute(SQL(
+            """
+            UPDATE update_webhook w SET is_pushed = TRUE
+              FROM (VALUES %s) AS v(id, change_seq)
+             WHERE w.id = v.id AND w.change_seq = v.change_seq
+            """,
+            SQL(", ").join(SQL("(%s::int, %s::bigint)", row['id'], row['change_seq']) for row in rows),
+        ))
+        self.invalidate_model(['is_pushed'])
+
+    @api.model
+    def _cron_push_pending(self, batch_size=PUSH_BATCH_SIZE):
+        """ قائمة إعادة المحاولة: يرسل الأحداث التي لم تصل إلى الـ gateway
+
+        Also the probe that closes the push breaker once the gateway is back.
+        """
+        url, token = self._get_gateway_config()
+        if not url:
+            return
+        window = fields.Datetime.now() - PUSH_RETRY_WINDOW
+        while True:
+            pending = self.search([
+                ('is_pushed', '=', False),
+                ('timestamp', '>=', window),
+            ], order='id asc', limit=batch_size)
+            if not pending:
+                return
+            for rows in pending._read_push_batches():
+                ok = _post_events(url, token, rows)
+                _pusher.record(ok)
+                if not ok:
+                    return
+                self._mark_pushed(rows)
+            self.env.cr.commit()
+            if len(pending) < batch_size:
+                return
+
+    def _compute_synced_user_ids(self):
+        # بحث واحد للدفعة كلها، ثم المقارنة في الذاكرة لكل سجل
+        seqs = [seq for seq in self.mapped('change_seq') if seq]
+        states = self.env['user.sync.state'].sudo()
+        if seqs:
+            states = states._states_from(min(seqs))
+        for rec in self:
+            seq = rec.change_seq
+            rec.synced_user_ids = states.filtered(lambda s: seq and s._has_synced(seq)).user_id
+
+    def mark_as_synced_by_user(self, user_id=None):
+        """ لم يعد يكتب شيئًا: الـ cursor و acked_ranges لكل جهاز يسجلان المزامنة
+
+        Kept for API compatibility; synced_user_ids is now derived from the
+        per-device watermarks in user.sync.state.
+        """
+        return True
+
+    # -----------------------------
+    # Compaction
+    # -----------------------------
+    @api.model
+    def get_compaction_horizon(self):
+        """ أعلى change_seq تم حذفه نهائيًا؛ أي cursor أقل منه يحتاج resync كامل """
+        return int(self.env['ir.config_parameter'].sudo().get_param(COMPACTION_HORIZON_PARAM, 0) or 0)
+
+    def _raise_compaction_horizon(self, change_seq):
+        if not change_seq or change_seq <= self.get_compaction_horizon():
+            return
+        self.env['ir.config_parameter'].sudo().set_param(COMPACTION_HORIZON_PARAM, str(change_seq))
+
+    def _retention_watermark(self, param, default_days):
+        days = self.env['ir.config_parameter'].sudo().get_param(param, default_days)
+        return fields.Datetime.now() - timedelta(days=int(days))
+
+    @api.model
+    def compact_events(self, batch_size=CLEANUP_CHUNK_SIZE, max_batches=10):
+        """ ضغط سجل الأحداث: آخر حدث فعّال لكل سجل، و tombstones للحذف
+
+        Below the compaction watermark, rows superseded by a newer event of
+        the same (model, record_id) are dropped; that never loses state since
+        the newer row has a higher change_seq. Unlink rows older than the
+        tombstone watermark are purged and the horizon is raised to the
+        highest change_seq removed. Bounded to batch_size * max_batches rows
+        per call; callers repeat until done is True.
+        """
+        self.check_access_rights('unlink')
+        batch_size = max(1, min(int(batch_size), 10000))
+        watermark = self._retention_watermark(COMPACTION_RETENTION_PARAM, COMPACTION_RETENTION_DAYS)
+        tombstone_watermark = self._retention_watermark(TOMBSTONE_RETENTION_PARAM, TOMBSTONE_RETENTION_DAYS)
+
+        superseded = tombstones = 0
+        budget = max(1, int(max_batches))
+        while budget:
+            budget -= 1
+            self.env.cr.execute(SQL(
+                """
+                DELETE FROM update_webhook WHERE id IN (
+                    SELECT old.id FROM update_webhook old
+                    WHERE old.timestamp < %s
+                      AND EXISTS (
+                          SELECT 1 FROM update_webhook newer
+                          WHERE newer.model = old.model
+                            AND newer.record_id = old.record_id
+                            AND newer.change_seq > old.change_seq
+                      )
+                    ORDER BY old.id LIMIT %s
+                )
+                """,
+                watermark, batch_size,
+            ))
+            superseded += self.env.cr.rowcount
+            if self.env.cr.rowcount < batch_size:
+                break
+        else:
+            self.invalidate_model()
+            return {'superseded': superseded, 'tombstones': 0, 'done': False,
+                    'horizon': self.get_compaction_horizon()}
+
+        done = False
+        budget = max(1, int(max_batches))
+        while budget:
+            budget -= 1
+            # 🪦 الـ tombstones القديمة: حذفها يرفع الـ horizon
+            self.env.cr.execute(SQL(
+                """
+                DELETE FROM update_webhook WHERE id IN (
+                    SELECT id FROM update_webhook
+                    WHERE event = 'unlink' AND timestamp < %s
+                    ORDER BY id LIMIT %s
+                )
+                RETURNING change_seq
+                """,
+                tombstone_watermark, batch_size,
+            ))
+            purged = [row[0] for row in self.env.cr.fetchall()]
+            tombstones += len(purged)
+            if purged:
+                self._raise_compaction_horizon(max(purged))
+            if len(purged) < batch_size:
+                done = True
+                break
+
+        self.invalidate_model()
+        return {'superseded': superseded, 'tombstones': tombstones, 'done': done,
+                'horizon': self.get_compaction_horizon()}
+
+    @api.model
+    def _cron_compact_events(self, batch_size=CLEANUP_CHUNK_SIZE):
+        """ ضغط دوري مع commit بين الدفعات حتى لا تطول الأقفال """
+        superseded = tombstones = 0
+        while True:
+            result = self.compact_events(batch_size=batch_size, max_batches=1)
+            superseded += result['superseded']
+            tombstones += result['tombstones']
+            self.env.cr.commit()
+            if result['done']:
+                break
+        _logger.info(
+            f"🗜️ Webhook compaction done: superseded={superseded} tombstones={tombstones} "
+            f"horizon={result['horizon']}"
+        )
+
+    @api.model
+    def cleanup_before(self, before=None, batch_size=CLEANUP_CHUNK_SIZE, max_batches=10, all_events=False):
+        """ حذف الأحداث ذات timestamp <= before على دفعات ثابتة الحجم
+
+        Deletes at most batch_size * max_batches rows per call so a single
+        RPC stays short; callers repeat until done is True. Deleted history
+        raises the compaction horizon so stale cursors are told to resync.
+        Emptying the whole log (and forcing every device into a full
+        resync) needs an explicit all_events=True; a missing before is
+        refused.
+        """
+        self.check_access_rights('unlink')
+        if not before and not all_events:
+            raise UserError(_("cleanup_before requires a 'before' timestamp, or all_events=True to delete every event."))
+        batch_size = max(1, min(int(batch_size), 10000))
+        where = SQL("timestamp <= %s", before) if before else SQL("TRUE")
+        deleted = 0
+        for _batch in range(max(1, int(max_batches))):
+            self.env.cr.execute(SQL(
+                """
+                DELETE FROM update_webhook WHERE id IN (
+                    SELECT id FROM update_webhook WHERE %s ORDER BY id LIMIT %s
+                )
+                RETURNING change_seq
+                """,
+                where, batch_size,
+            ))
+            removed = [row[0] for row in self.env.cr.fetchall()]
+            if removed:
+                self._raise_compaction_horizon(max(removed))
+            count = len(removed)
+            deleted += count
+            if count < batch_size:
+                self.invalidate_model()
+                return {'deleted': deleted, 'done': True}
+        self.invalidate_model()
+        return {'deleted': deleted, 'done': False}
 
 
 class WebhookErrors(models.Model):
@@ -106,10 +623,48 @@ class WebhookCleanupCron(models.Model):
     _description = 'Cron Job to clean up outdated webhook records'
 
     @api.model
-    def clean_webhook_records(self):
-        webhook_records = self.env['update.webhook'].search([])
-        for record in webhook_records:
-            model_obj = self.env.get(record.model)
-            if model_obj and not model_obj.search([('id', '=', record.record_id)]):
-                record.unlink()
-                _logger.info(f"🗑️ Removed orphaned webhook record_id {record.record_id} from {record.model}.")
\ No newline at end of file
+    def clean_webhook_records(self, chunk_size=CLEANUP_CHUNK_SIZE):
+        """ حذف أحداث السجلات التي لم تعد موجودة، نموذجًا بنموذج وعلى دفعات
+
+        Unlink events are tombstones for records that are already gone and
+        are left to compaction. Walks update.webhook per model by id in
+        chunks of chunk_size: one
+        existence query per chunk against the target table, one bounded
+        unlink of the orphans, then a commit so locks are released between
+        chunks and memory stays flat.
+        """
+        cr = self.env.cr
+        cr.execute("SELECT DISTINCT model FROM update_webhook")
+        model_names = [row[0] for row in cr.fetchall()]
+
+        Webhook = self.env['update.webhook'].sudo()
+        scanned = removed = 0
+        for model_name in model_names:
+            model_obj = self.env.get(model_name)
+            if model_obj is None or model_obj._abstract:
+                continue
+            target = model_obj.sudo().with_context(active_test=False)
+            last_id = 0
+            while True:
+                cr.execute(
+                    "SELECT id, record_id FROM update_webhook"
+                    " WHERE model = %s AND event != 'unlink' AND id > %s ORDER BY id LIMIT %s",
+                    (model_name, last_id, chunk_size),
+                )
+                rows = cr.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                scanned += len(rows)
+
+                alive = set(target.browse({record_id for _id, record_id in rows}).exists().ids)
+                orphan_ids = [webhook_id for webhook_id, record_id in rows if record_id not in alive]
+                if orphan_ids:
+                    Webhook.browse(orphan_ids).unlink()
+                    removed += len(orphan_ids)
+                    _logger.info(f"🗑️ Removed {len(orphan_ids)} orphaned webhook records from {model_name}.")
+                cr.commit()
+                self.env.invalidate_all()
+
+        _logger.info(f"🧹 Webhook cleanup done: scanned={scanned} removed={removed}")
+        return {'scanned': scanned, 'removed': removed}
@@ -3,22 +3,101 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+# cr.precommit.data key holding {(model, record_id): (event, timestamp)}.
+# Odoo runs precommit hooks at commit and on every cr.flush(), which includes
+# entering and leaving each savepoint(): the buffer covers the events between
+# two flushes, not the whole transaction.
+PENDING_EVENTS_KEY = 'webhook.pending_events'
+
+# حقول لا تغيّر ما يعرضه التطبيق؛ كتابة تمسّها وحدها لا تُنتج حدث write
+WEBHOOK_IGNORED_FIELDS = frozenset({
+    'write_date', 'write_uid', 'create_date', 'create_uid', '__last_update',
+    'message_main_attachment_id',
+})
+WEBHOOK_IGNORED_PREFIXES = ('message_', 'activity_', 'website_message_', 'rating_')
+# ir.config_parameter override, e.g. webhook.tracked_fields.res.partner = "name,phone,email"
+TRACKED_FIELDS_PARAM = 'webhook.tracked_fields.%s'
+
+
+def _coalesce_events(previous, event):
+    """ دمج حدثين لنفس السجل داخل نفس المعاملة؛ None = لا شيء يُسجَّل """
+    if previous == 'create':
+        # create+write = create ، create+unlink = لا شيء
+        return None if event == 'unlink' else 'create'
+    return event
+
+
 class WebhookMixin(models.AbstractModel):
     _name = 'webhook.mixin'
     _description = 'Webhook Mixin for tracking model changes'
 
+    # None = كل الحقول عدا المُهمَلة؛ وإلا فقط هذه الحقول تُنتج حدث write
+    _webhook_tracked_fields = None
+    # حقول إضافية خاصة بالنموذج لا تُنتج حدث write
+    _webhook_ignored_fields = ()
+
+    def _webhook_tracked_field_names(self):
+        """ الحقول المعتمدة: إعداد النظام أولًا ثم _webhook_tracked_fields """
+        param = self.env['ir.config_parameter'].sudo().get_param(TRACKED_FIELDS_PARAM % self._name)
+        if param:
+            return frozenset(name.strip() for name in param.split(',') if name.strip())
+        if self._webhook_tracked_fields is not None:
+            return frozenset(self._webhook_tracked_fields)
+        return None
+
+    def _webhook_is_relevant_write(self, vals):
+        """ هل تمسّ الكتابة حقلًا واحدًا على الأقل يهم الأجهزة؟ """
+        tracked = self._webhook_tracked_field_names()
+        if tracked is not None:
+            return any(name in tracked for name in vals)
+        return any(
+            name not in WEBHOOK_IGNORED_FIELDS
+            and name not in self._webhook_ignored_fields
+            and not name.startswith(WEBHOOK_IGNORED_PREFIXES)
+            for name in vals
+        )
 
     def _log_webhook_event(self, event):
-        """تسجيل الحدث دون الحاجة إلى _is_tracked_model"""
-        _logger.info(f"📡 WebhookMixin: Logging {event} for {self._name}")
-        records = [{
-            "model": record._name,
-            "record_id": record.id,
-            "event": event,
-            "timestamp": fields.Datetime.now()
-        } for record in self]
+        """تسجيل الحدث في buffer؛ الكتابة الفعلية عند الـ flush التالي (commit أو savepoint)"""
+        if not self:
+            return
+        _logger.info(f"📡 WebhookMixin: Buffering {event} for {self._name}")
+        precommit = self.env.cr.precommit
+        pending = precommit.data.get(PENDING_EVENTS_KEY)
+        if pending is None:
+            pending = precommit.data[PENDING_EVENTS_KEY] = {}
+            precommit.add(self._flush_webhook_events)
+
+        now = fields.Datetime.now()
+        for record in self:
+            key = (record._name, record.id)
+            previous = pending.get(key)
+            merged = _coalesce_events(previous and previous[0], event)
+            if merged is None:
+                pending.pop(key, None)
+            else:
+                pending[key] = (merged, now)
 
-        self.env['update.webhook'].sudo().create(records)
+    def _flush_webhook_events(self):
+        """ إدخال الأحداث المدمجة منذ آخر flush دفعة واحدة
+
+        Runs at commit and at every flush before it (savepoint boundaries),
+        so events are merged per flush interval. Across intervals the
+        update.webhook upsert still keeps one row per (model, record_id,
+        event) and drops writes superseded by a create; a create and an
+        unlink of the same record split by a flush both stay in the log.
+        """
+        pending = self.env.cr.precommit.data.pop(PENDING_EVENTS_KEY, None)
+        if not pending:
+            return
+        webhooks = self.env['update.webhook'].sudo()
+        webhooks.create([{
+            "model": model,
+            "record_id": record_id,
+            "event": event,
+            "timestamp": timestamp,
+        } for (model, record_id), (event, timestamp) in pending.items()])
+        webhooks.flush_model()
 
 
     @api.model_create_multi
@@ -29,7 +108,8 @@ class WebhookMixin(models.AbstractModel):
 
     def write(self, vals):
         res = super(WebhookMixin, self).write(vals)
-        self._log_webhook_event("write")
+        if self._webhook_is_relevant_write(vals):
+            self._log_webhook_event("write")
         return res
 
     def unlink(self):
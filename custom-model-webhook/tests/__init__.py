@@ -0,0 +1,3 @@
+from . import test_cleanup
+from . import test_change_seq
+from . import test_sync_state
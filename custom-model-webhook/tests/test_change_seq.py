@@ -0,0 +1,51 @@
+from odoo.tests import TransactionCase, tagged # type: ignore
+
+
+@tagged('post_install', '-at_install')
+class TestCommitOrderedChangeSeq(TransactionCase):
+    """ change_seq يُسحب عند الـ COMMIT: معاملة طويلة لا تقع تحت cursor تجاوزها """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Webhook = cls.env['update.webhook']
+        cls.States = cls.env['user.sync.state']
+        cls.Webhook.search([]).unlink()
+
+    def _commit(self):
+        # ما يحدث عند COMMIT: تُنفَّذ الـ triggers المؤجلة
+        self.env.cr.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        self.env.cr.execute("SET CONSTRAINTS ALL DEFERRED")
+        self.Webhook.invalidate_model(['change_seq', 'change_at'])
+
+    def _next_seq(self):
+        self.env.cr.execute("SELECT nextval('update_webhook_change_seq')")
+        return self.env.cr.fetchone()[0]
+
+    def test_savepoint_does_not_draw_final_change_seq(self):
+        event = self.Webhook.create({'model': 'res.partner', 'record_id': 1, 'event': 'write'})
+        drawn = event.change_seq
+        with self.env.cr.savepoint():
+            self.env.flush_all()
+        self.Webhook.invalidate_model(['change_seq'])
+        self.assertEqual(event.change_seq, drawn)
+
+    def test_late_commit_is_still_pulled(self):
+        slow = self.Webhook.create({'model': 'res.partner', 'record_id': 1, 'event': 'write'})
+        # معاملة أخرى سحبت قيمة أعلى و commit، وجهاز زامن حتى هذه القيمة
+        fast_seq = self._next_seq()
+        self.assertLess(slow.change_seq, fast_seq)
+        state = self.States._get_or_create(self.env.uid, 'late-commit-device', 'sales_app')
+        state.last_event_id = fast_seq
+
+        self._commit()
+        self.assertGreater(slow.change_seq, fast_seq)
+
+        # انقضت مهلة الـ settle منذ الـ commit
+        self.env.cr.execute(
+            "UPDATE update_webhook SET change_at = (now() AT TIME ZONE 'UTC') - interval '1 minute' WHERE id = %s",
+            (slow.id,),
+        )
+        result = self.States.sync_pull(self.env.uid, 'late-commit-device', 'sales_app')
+        self.assertEqual([e['id'] for e in result['events']], [slow.id])
+        self.assertEqual(result['last_event_id'], slow.change_seq)
@@ -0,0 +1,36 @@
+from odoo.exceptions import UserError # type: ignore
+from odoo.tests import TransactionCase, tagged # type: ignore
+
+
+@tagged('post_install', '-at_install')
+class TestCleanupBefore(TransactionCase):
+    """ cleanup_before: لا حذف كامل للسجل بدون طلب صريح """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Webhook = cls.env['update.webhook']
+        cls.Webhook.search([]).unlink()
+        cls.Webhook.create([
+            {'model': 'res.partner', 'record_id': 1, 'event': 'write', 'timestamp': '2024-01-01 00:00:00'},
+            {'model': 'res.partner', 'record_id': 2, 'event': 'write', 'timestamp': '2024-06-01 00:00:00'},
+        ])
+
+    def test_missing_before_is_refused(self):
+        horizon = self.Webhook.get_compaction_horizon()
+        with self.assertRaises(UserError):
+            self.Webhook.cleanup_before()
+        self.assertEqual(self.Webhook.search_count([]), 2)
+        self.assertEqual(self.Webhook.get_compaction_horizon(), horizon)
+
+    def test_before_deletes_older_events_only(self):
+        result = self.Webhook.cleanup_before('2024-03-01 00:00:00')
+        self.assertEqual(result, {'deleted': 1, 'done': True})
+        self.assertEqual(self.Webhook.search([]).mapped('record_id'), [2])
+
+    def test_all_events_empties_the_log(self):
+        head = max(self.Webhook.search([]).mapped('change_seq'))
+        result = self.Webhook.cleanup_before(all_events=True)
+        self.assertEqual(result, {'deleted': 2, 'done': True})
+        self.assertFalse(self.Webhook.search([]))
+        self.assertGreaterEqual(self.Webhook.get_compaction_horizon(), head)
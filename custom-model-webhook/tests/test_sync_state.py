@@ -0,0 +1,29 @@
+from odoo.tests import TransactionCase, new_test_user, tagged # type: ignore
+
+
+@tagged('post_install', '-at_install')
+class TestUnsyncedDevices(TransactionCase):
+    """ unsynced_devices: كل مستخدم يرى أجهزته فقط """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.alice = new_test_user(cls.env, login='webhook_alice', groups='base.group_user')
+        cls.bob = new_test_user(cls.env, login='webhook_bob', groups='base.group_user')
+        cls.event = cls.env['update.webhook'].create(
+            {'model': 'res.partner', 'record_id': 1, 'event': 'write'}
+        )
+        States = cls.env['user.sync.state']
+        for user in (cls.alice, cls.bob):
+            States._get_or_create(user.id, f'{user.login}-phone', 'sales_app')
+
+    def _device_owners(self, user):
+        result = self.env['user.sync.state'].with_user(user).unsynced_devices(self.event.id)
+        return {d['user_id'] for d in result['devices']}
+
+    def test_user_sees_only_own_devices(self):
+        self.assertEqual(self._device_owners(self.alice), {self.alice.id})
+        self.assertEqual(self._device_owners(self.bob), {self.bob.id})
+
+    def test_administrator_sees_every_device(self):
+        self.assertLessEqual({self.alice.id, self.bob.id}, self._device_owners(self.env.ref('base.user_admin')))
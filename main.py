@@ -1,22 +1,123 @@
 # main.py
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 
-# Rate limiting (slowapi)
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
 
 from webhook.update_webhook import router as updates_router
 from webhook.webhook import router as webhook_router
 from webhook.smart_sync import router as smart_sync_router
+from webhook.ingest import router as ingest_router
+from core.transport import create_odoo_transport
+from core.event_feed import EventFeed
+from core.jobs import JobRegistry
+from core.cache import EventPageCache, ResponseCache
+from core.auth import SessionCache
+from core.ratelimit import create_rate_limiter
+from core.replica import EventReplica
+from core.singleflight import SingleFlight
+from core.cursors import CursorBuffer
+from config import (
+    EVENT_FEED_POLL_INTERVAL,
+    EVENT_FEED_BUFFER_SIZE,
+    EVENT_FEED_SAFETY_INTERVAL,
+    INGEST_TOKEN,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    EVENT_PAGE_CACHE_MAX_PAGES,
+    SYNC_CURSOR_FLUSH_INTERVAL,
+    SYNC_CURSOR_FLUSH_BATCH,
+    SYNC_CURSOR_MAX_ENTRIES,
+    SYNC_CURSOR_LOCK_PATH,
+    SESSION_CACHE_TTL,
+    SESSION_CACHE_NEGATIVE_TTL,
+    SESSION_CACHE_MAX_ENTRIES,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MMAP_PATH,
+    RATE_LIMIT_REDIS_URL,
+    ODOO_DB,
+    ODOO_USERNAME,
+    ODOO_PASSWORD,
+    REPLICA_PATH,
+    REPLICA_MAX_LAG,
+    REPLICA_POLL_INTERVAL,
+    REPLICA_BATCH_SIZE,
+)
+
+# ==========================
+# Lifespan: shared Odoo connection pool + event watcher
+# ==========================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.odoo_transport = create_odoo_transport()
+    app.state.event_feed = EventFeed(
+        transport=app.state.odoo_transport,
+        poll_interval=EVENT_FEED_POLL_INTERVAL,
+        buffer_size=EVENT_FEED_BUFFER_SIZE,
+        safety_interval=EVENT_FEED_SAFETY_INTERVAL if INGEST_TOKEN else None,
+    )
+    app.state.event_feed.start()
+    app.state.jobs = JobRegistry()
+    app.state.response_cache = ResponseCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL)
+    app.state.event_page_cache = EventPageCache(max_pages=EVENT_PAGE_CACHE_MAX_PAGES)
+    # Rate limiting shared across workers: memory | mmap | redis
+    app.state.limiter = create_rate_limiter(
+        RATE_LIMIT_BACKEND,
+        mmap_path=RATE_LIMIT_MMAP_PATH,
+        redis_url=RATE_LIMIT_REDIS_URL,
+    )
+    # طلبات القراءة المتطابقة المتزامنة تتشارك استدعاء Odoo واحدًا
+    app.state.singleflight = SingleFlight()
+    app.state.session_cache = SessionCache(
+        ttl=SESSION_CACHE_TTL,
+        negative_ttl=SESSION_CACHE_NEGATIVE_TTL,
+        max_entries=SESSION_CACHE_MAX_ENTRIES,
+    )
+    app.state.cursors = None
+    # الـ flush يكتب cursors كل المستخدمين: حساب الخدمة فقط (Webhook Gateway Service)
+    if SYNC_CURSOR_FLUSH_INTERVAL > 0 and ODOO_USERNAME and ODOO_PASSWORD:
+        cursors = CursorBuffer(
+            transport=app.state.odoo_transport,
+            credentials=(ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD),
+            flush_interval=SYNC_CURSOR_FLUSH_INTERVAL,
+            batch_size=SYNC_CURSOR_FLUSH_BATCH,
+            max_entries=SYNC_CURSOR_MAX_ENTRIES,
+        )
+        # worker واحد فقط يملك الـ buffer؛ البقية تكتب الـ cursor مباشرة في Odoo
+        if cursors.acquire_owner(SYNC_CURSOR_LOCK_PATH):
+            app.state.cursors = cursors
+            cursors.start()
+    app.state.replica = None
+    if REPLICA_PATH and ODOO_USERNAME and ODOO_PASSWORD:
+        app.state.replica = EventReplica(
+            REPLICA_PATH,
+            transport=app.state.odoo_transport,
+            db=ODOO_DB,
+            login=ODOO_USERNAME,
+            password=ODOO_PASSWORD,
+            max_lag=REPLICA_MAX_LAG,
+            poll_interval=REPLICA_POLL_INTERVAL,
+            batch_size=REPLICA_BATCH_SIZE,
+        )
+        app.state.replica.start()
+    try:
+        yield
+    finally:
+        if app.state.replica is not None:
+            await app.state.replica.stop()
+        if app.state.cursors is not None:
+            # آخر flush قبل إغلاق الـ pool
+            await app.state.cursors.stop()
+        await app.state.jobs.shutdown()
+        await app.state.event_feed.stop()
+        await app.state.odoo_transport.aclose()
+        await app.state.limiter.close()
 
 # ==========================
 # Initialize FastAPI
 # ==========================
 app = FastAPI(
+    lifespan=lifespan,
     title="Odoo Webhook Server",
     version="2.0.0",
     description="API for Odoo webhooks integration with Multi-User Smart Sync",
@@ -42,33 +143,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ==========================
-# Rate Limiting (slowapi)
-# ==========================
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-
-@app.exception_handler(RateLimitExceeded)
-def _rate_limit_handler(request, exc):
-    return JSONResponse(
-        status_code=429,
-        content={"error": "Too many requests, please slow down."},
-    )
-
-app.add_middleware(SlowAPIMiddleware)
-
 # ==========================
 # Routers
 # ==========================
 app.include_router(updates_router)      # /api/v1/check-updates , /api/v1/cleanup
 app.include_router(webhook_router)      # /api/v1/webhook/events
 app.include_router(smart_sync_router)   # /api/v2/sync/* (NEW - Smart Multi-User Sync)
+app.include_router(ingest_router)       # /api/v2/ingest (push from Odoo module)
 
 # ==========================
 # Health check
 # ==========================
 @app.get("/", tags=["General"])
-def root():
+async def root(request: Request):
+    # حالة الـ replica الفعلية (lag، settled_seq) لا مجرد وجود الإعدادات
+    replica = request.app.state.replica
+    replica_status = "disabled"
+    if replica is not None:
+        replica_status = {**await replica.status(), "fresh": await replica.is_fresh()}
     return {
         "message": "Welcome to Odoo Webhook Server",
         "status": "running",
@@ -77,10 +169,12 @@ def root():
             "webhook": "active",
             "check_updates": "active",
             "cleanup": "active",
-            "smart_sync": "active"  # NEW
+            "smart_sync": "active",  # NEW
+            "ingest": "active" if INGEST_TOKEN else "disabled",
+            "replica": replica_status,
         },
         "endpoints": {
             "v1": ["/api/v1/webhook/events", "/api/v1/check-updates", "/api/v1/cleanup"],
-            "v2": ["/api/v2/sync/pull", "/api/v2/sync/state", "/api/v2/sync/reset"]
+            "v2": ["/api/v2/sync/pull", "/api/v2/sync/wait", "/api/v2/sync/stream", "/api/v2/sync/state", "/api/v2/sync/reset", "/api/v2/sync/cache-stats", "/api/v2/sync/ack", "/api/v2/sync/events/{event_id}/unsynced-devices", "/api/v2/ingest"]
         }
     }
\ No newline at end of file
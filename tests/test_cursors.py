@@ -0,0 +1,73 @@
+import asyncio
+import json
+import unittest
+
+import httpx
+
+from clients.odoo_client import OdooError
+from core.cursors import CursorBuffer
+
+
+def _odoo(handler):
+    """Mock Odoo transport: handler(path, params) returns the JSON-RPC result."""
+    def respond(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        result = handler(request.url.path, payload.get("params") or {})
+        return httpx.Response(200, json={"jsonrpc": "2.0", "id": payload.get("id"), "result": result})
+    return httpx.MockTransport(respond)
+
+
+class TestCursorFlush(unittest.TestCase):
+    """ فشل الـ flush لا يُضيّع تقدّم الـ cursors المخزنة """
+
+    def _buffer(self, handler):
+        buffer = CursorBuffer(transport=_odoo(handler), credentials=("db", "svc", "secret"))
+        buffer.load(7, "phone", "sales_app", {"last_event_id": 10})
+        self.assertTrue(buffer.advance(7, "phone", 10, 15))
+        return buffer
+
+    def test_failed_authentication_keeps_pulls_pending(self):
+        odoo_up = False
+        calls = []
+
+        def handler(path, params):
+            calls.append(path)
+            if path == "/web/session/authenticate":
+                return {"uid": 2} if odoo_up else {"uid": False}
+            return {"applied": [[7, "phone"]], "horizon": 0}
+
+        buffer = self._buffer(handler)
+
+        async def scenario():
+            with self.assertRaises(OdooError):
+                await buffer.flush()
+            self.assertEqual(buffer.pending, 1)
+            nonlocal odoo_up
+            odoo_up = True
+            self.assertEqual(await buffer.flush(), 1)
+            await buffer.stop()
+
+        asyncio.run(scenario())
+        self.assertEqual(buffer.pending, 0)
+        self.assertEqual(buffer.get(7, "phone")["base"], 15)
+        self.assertEqual(calls.count("/web/dataset/call_kw"), 1)
+
+    def test_failed_advance_keeps_pulls_pending(self):
+        def handler(path, params):
+            if path == "/web/session/authenticate":
+                return {"uid": 2}
+            raise httpx.ConnectError("odoo down")
+
+        buffer = self._buffer(handler)
+
+        async def scenario():
+            with self.assertRaises(httpx.ConnectError):
+                await buffer.flush()
+            self.assertEqual(buffer.pending, 1)
+            self.assertEqual(buffer.get(7, "phone")["last_event_id"], 15)
+
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
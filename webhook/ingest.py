@@ -0,0 +1,56 @@
+# webhook/ingest.py - Push ingest from the Odoo module
+import hmac
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from pydantic import BaseModel, Field
+
+from core.event_feed import EventFeed, get_event_feed
+from core.replica import EventReplica, get_replica
+from config import INGEST_TOKEN, INGEST_MAX_EVENTS
+
+router = APIRouter(prefix="/api/v2", tags=["ingest"])
+
+# ===== Schemas =====
+class IngestEvent(BaseModel):
+    id: int
+    change_seq: int
+    model: str
+    record_id: int
+    event: str
+    timestamp: str
+
+class IngestRequest(BaseModel):
+    events: List[IngestEvent] = Field(..., max_length=INGEST_MAX_EVENTS)
+
+class IngestResponse(BaseModel):
+    status: str = "success"
+    accepted: int
+    last_change_seq: int
+
+# ===== Dependencies =====
+def verify_ingest_token(x_ingest_token: Optional[str] = Header(default=None, alias="X-Ingest-Token")) -> None:
+    if not INGEST_TOKEN:
+        raise HTTPException(status_code=503, detail="INGEST_DISABLED: INGEST_TOKEN is not configured")
+    if not x_ingest_token or not hmac.compare_digest(x_ingest_token, INGEST_TOKEN):
+        raise HTTPException(status_code=401, detail="BAD_INGEST_TOKEN")
+
+# ===== Routes =====
+@router.post("/ingest", response_model=IngestResponse, dependencies=[Depends(verify_ingest_token)])
+async def ingest_events(
+    payload: IngestRequest,
+    feed: EventFeed = Depends(get_event_feed),
+    replica: Optional[EventReplica] = Depends(get_replica),
+):
+    """
+    Receives batches of committed update.webhook events pushed by the Odoo
+    module's post-commit hook. Events go straight into the shared feed, so
+    /api/v2/sync/wait and /api/v2/sync/stream are served without polling Odoo.
+    Re-delivered events (retries) are ignored. The local replica, when
+    enabled, is updated as well.
+    """
+    events = [e.model_dump() for e in payload.events]
+    await feed.publish(events, pushed=True)
+    if replica is not None:
+        await replica.apply(events)
+    return IngestResponse(accepted=len(payload.events), last_change_seq=feed.last_seq)
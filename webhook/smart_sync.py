@@ -1,16 +1,34 @@
 # webhook/smart_sync.py - Smart Multi-User Sync API
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional, List
+import asyncio
+import json
+import random
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, Optional, List
 from starlette.requests import Request
+import httpx
 from pydantic import BaseModel, Field
 
-from core.auth import get_session_id
-from clients.odoo_client import OdooClient, OdooError
-from config import ODOO_URL
-
-# Rate limiting
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from core.auth import SessionInfo, get_session, get_session_id
+from core.transport import get_odoo_transport
+from core.singleflight import SingleFlight, get_singleflight
+from core.event_feed import EventFeed, FeedSubscription, get_event_feed
+from core.cache import EventPageCache, ResponseCache, get_event_page_cache, get_response_cache, respond_cached
+from core.replica import EventReplica, get_replica
+from core.cursors import CursorBuffer, get_cursor_buffer
+from clients.odoo_client import AsyncOdooClient, OdooError
+from config import (
+    ODOO_URL,
+    SYNC_WAIT_DEFAULT_TIMEOUT,
+    SYNC_WAIT_MAX_TIMEOUT,
+    SSE_MAX_SUBSCRIBERS,
+    SSE_QUEUE_SIZE,
+    SSE_KEEPALIVE_INTERVAL,
+)
+
+# Rate limiting (shared across workers, keyed by session)
+from core.ratelimit import RateLimiter, get_rate_limiter, rate_limit_key
 
 router = APIRouter(prefix="/api/v2/sync", tags=["smart-sync"])
 
@@ -21,13 +39,16 @@ class SyncRequest(BaseModel):
     app_type: str = Field(..., description="App type: sales_app, delivery_app, manager_app, etc.")
     models_filter: Optional[List[str]] = Field(None, description="Optional: filter by specific models")
     limit: int = Field(100, ge=1, le=500, description="Max events to fetch")
+    include_data: bool = Field(False, description="Inline record payloads (app type field projection) in each event")
 
 class EventData(BaseModel):
     id: int
+    change_seq: int  # ترتيب التغيير؛ يُستخدم كـ sync token
     model: str
     record_id: int
     event: str
     timestamp: str
+    data: Optional[Dict[str, Any]] = None  # مع include_data فقط؛ {"id": ...} للحذف
 
 class SyncResponse(BaseModel):
     status: str = "success"
@@ -36,6 +57,12 @@ class SyncResponse(BaseModel):
     events: List[EventData]
     next_sync_token: str
     last_sync_time: str
+    resync_required: bool = False  # الـ token أقدم من آخر ضغط للسجل: مزامنة كاملة ثم متابعة من next_sync_token
+
+class SyncWaitResponse(BaseModel):
+    status: str = "success"
+    has_updates: bool
+    next_sync_token: str
 
 class SyncStatsResponse(BaseModel):
     user_id: int
@@ -45,6 +72,31 @@ class SyncStatsResponse(BaseModel):
     sync_count: int
     is_active: bool
 
+class AckRequest(BaseModel):
+    user_id: int
+    device_id: str = Field(..., min_length=1, max_length=255)
+    app_type: str
+    change_seqs: List[int] = Field(..., max_length=1000, description="change_seq of events received out of order (stream)")
+
+class AckResponse(BaseModel):
+    status: str = "success"
+    last_event_id: int
+    acked_ranges: List[List[int]]  # [[lo, hi], ...] فوق last_event_id
+
+class UnsyncedDevice(BaseModel):
+    user_id: int
+    device_id: str
+    app_type: str
+    last_event_id: int
+    last_sync_time: str
+
+class UnsyncedDevicesResponse(BaseModel):
+    event_id: int
+    change_seq: int
+    model: str
+    count: int
+    devices: List[UnsyncedDevice]
+
 # ===== Model Filters by App Type =====
 APP_TYPE_MODELS = {
     "sales_app": [
@@ -76,113 +128,299 @@ APP_TYPE_MODELS = {
     ],
 }
 
+# ===== Field projections for include_data =====
+_PARTNER_FIELDS = ["name", "email", "phone", "street", "city", "country_id"]
+_SALE_ORDER_FIELDS = ["name", "partner_id", "date_order", "state", "amount_total", "currency_id"]
+_PRODUCT_TEMPLATE_FIELDS = ["name", "default_code", "list_price", "categ_id", "active"]
+_PICKING_FIELDS = ["name", "partner_id", "scheduled_date", "origin", "state"]
+
+APP_TYPE_FIELDS: Dict[str, Dict[str, List[str]]] = {
+    "sales_app": {
+        "sale.order": _SALE_ORDER_FIELDS,
+        "res.partner": _PARTNER_FIELDS,
+        "product.template": _PRODUCT_TEMPLATE_FIELDS,
+        "product.category": ["name", "parent_id"],
+    },
+    "delivery_app": {
+        "stock.picking": _PICKING_FIELDS,
+        "res.partner": _PARTNER_FIELDS,
+    },
+    "warehouse_app": {
+        "stock.picking": _PICKING_FIELDS,
+        "stock.move": ["product_id", "product_uom_qty", "quantity", "picking_id", "state"],
+        "product.product": ["name", "default_code", "barcode", "qty_available"],
+    },
+    "manager_app": {
+        "sale.order": _SALE_ORDER_FIELDS,
+        "res.partner": _PARTNER_FIELDS,
+        "account.move": ["name", "partner_id", "invoice_date", "amount_total", "state", "payment_state"],
+        "purchase.order": ["name", "partner_id", "date_order", "amount_total", "state"],
+        "hr.expense": ["name", "employee_id", "total_amount", "state"],
+    },
+    "mobile_app": {
+        "sale.order": _SALE_ORDER_FIELDS,
+        "res.partner": _PARTNER_FIELDS,
+        "product.template": _PRODUCT_TEMPLATE_FIELDS,
+    },
+}
+DEFAULT_SYNC_FIELDS = ["display_name", "write_date"]
+
 # ===== Dependencies =====
-def get_client(session_id: str = Depends(get_session_id)) -> OdooClient:
-    return OdooClient(
+async def get_client(
+    session: SessionInfo = Depends(get_session),
+    transport: httpx.AsyncHTTPTransport = Depends(get_odoo_transport),
+    singleflight: SingleFlight = Depends(get_singleflight),
+) -> AsyncIterator[AsyncOdooClient]:
+    # كل طلب يحمل session cookie خاص به فوق نفس الـ pool المشترك؛ الجلسة مُتحقق منها مسبقًا
+    client = AsyncOdooClient(
         base_url=ODOO_URL,
-        session_id=session_id,
+        session_id=session.session_id,
         timeout=15,
         retries=2,
         backoff=0.3,
         user_agent="SmartSyncAPI/2.0",
+        transport=transport,
+        coalescer=singleflight,
+        coalesce_scope=session.scope,
     )
-
-def _get_limiter(request: Request) -> Limiter:
-    return request.app.state.limiter
+    try:
+        yield client
+    finally:
+        await client.aclose()
+
+def _resolve_models(app_type: str, models_filter: Optional[List[str]]) -> Optional[List[str]]:
+    """Models a device cares about: app type models ∩ optional filter (None = all)."""
+    allowed_models = APP_TYPE_MODELS.get(app_type, [])
+    if allowed_models and models_filter:
+        return [m for m in allowed_models if m in models_filter]
+    return allowed_models or models_filter or None
+
+async def _fetch_event_data(
+    client: AsyncOdooClient,
+    app_type: str,
+    events: List[dict],
+) -> Dict[tuple, Dict[str, Any]]:
+    """Record payloads for a page of events: one search_read per model, one HTTP request.
+
+    Returns {(model, record_id): data}. Records deleted since the event, or
+    models the user cannot read, are left out so the device falls back to
+    its own read.
+    """
+    ids_by_model: Dict[str, set] = {}
+    for e in events:
+        if e["event"] != "unlink":
+            ids_by_model.setdefault(e["model"], set()).add(e["record_id"])
+    if not ids_by_model:
+        return {}
+
+    projections = APP_TYPE_FIELDS.get(app_type, {})
+    models = list(ids_by_model)
+    results = await client.call_kw_many([
+        (
+            model,
+            "search_read",
+            [[("id", "in", sorted(ids_by_model[model]))]],
+            {
+                "fields": projections.get(model, DEFAULT_SYNC_FIELDS),
+                "context": {"active_test": False},
+            },
+        )
+        for model in models
+    ])
+
+    data: Dict[tuple, Dict[str, Any]] = {}
+    for model, rows in zip(models, results):
+        if isinstance(rows, OdooError):
+            continue
+        for row in rows:
+            data[(model, row["id"])] = row
+    return data
+
+async def _pull_split(
+    client: AsyncOdooClient,
+    replica: Optional[EventReplica],
+    pages: EventPageCache,
+    cursors: Optional[CursorBuffer],
+    sync_request: SyncRequest,
+    allowed_models: List[str],
+) -> Optional[dict]:
+    """sync_pull with the event scan served by the gateway.
+
+    The page comes from the shared page cache, else from the local replica
+    when it is fresh. The cursor is read from and advanced in the
+    write-behind buffer when enabled (no Odoo round trip once the device is
+    buffered), otherwise Odoo resolves it and advances it (compare-and-set).
+    Without a fresh replica the cursor is only read when it is already in
+    memory, so a page cache miss never costs a state lookup on top of
+    sync_pull. Returns None when Odoo must handle the pull itself: no
+    cached page and no fresh replica, a cursor that predates compaction, or
+    another pull that moved the cursor meanwhile.
+    """
+    user_id, device_id = sync_request.user_id, sync_request.device_id
+    state = cursors.get(user_id, device_id) if cursors is not None else None
+    fresh = replica is not None and await replica.is_fresh()
+    if state is None and not fresh:
+        # لا cursor في الذاكرة ولا replica: sync_pull واحد يكفي
+        pages.misses[sync_request.app_type] += 1
+        return None
+    if state is None:
+        state = await client.call_kw(
+            "user.sync.state",
+            "get_or_create_state",
+            [user_id, device_id, sync_request.app_type],
+        )
+        if cursors is not None:
+            state = cursors.load(user_id, device_id, sync_request.app_type, state)
+    cursor = state.get("last_event_id", 0)
+    result = {"events": [], "last_event_id": cursor, "last_sync_time": state.get("last_sync_time") or ""}
+
+    horizon = cursors.horizon if cursors is not None else 0
+    page_key = pages.key(allowed_models, sync_request.models_filter, cursor, sync_request.limit)
+    events = pages.get(sync_request.app_type, page_key)
+    if events is None:
+        if not fresh:
+            return None
+        status = await replica.status()
+        horizon = max(horizon, status["horizon"])
+        if cursor < horizon:
+            return None
+        events = await replica.events_after(
+            cursor, allowed_models, sync_request.models_filter, limit=sync_request.limit
+        )
+        pages.put(page_key, events, status["settled_seq"])
+    elif cursor < horizon:
+        return None
+    if not events:
+        return result
+
+    to_seq = events[-1]["change_seq"]
+    if cursors is not None:
+        # يُحفظ في Odoo مع الـ flush التالي (دفعة واحدة لكل الأجهزة)
+        if not cursors.advance(user_id, device_id, cursor, to_seq):
+            return None
+        result["events"] = events
+        result["last_event_id"] = to_seq
+        return result
+
+    advanced = await client.call_kw(
+        "user.sync.state",
+        "sync_advance",
+        [user_id, device_id, sync_request.app_type, cursor, to_seq],
+    )
+    if not advanced.get("advanced"):
+        return None
+    result["events"] = events
+    result["last_event_id"] = advanced["last_event_id"]
+    return result
 
 # ===== Routes =====
 @router.post("/pull", response_model=SyncResponse)
-def sync_pull(
+async def sync_pull(
     request: Request,
     sync_request: SyncRequest,
-    client: OdooClient = Depends(get_client),
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    replica: Optional[EventReplica] = Depends(get_replica),
+    pages: EventPageCache = Depends(get_event_page_cache),
+    cursors: Optional[CursorBuffer] = Depends(get_cursor_buffer),
+    session: SessionInfo = Depends(get_session),
+    client: AsyncOdooClient = Depends(get_client),
 ):
     """
     Smart sync - pulls only what the user needs based on their last sync state.
-    Rate limited to 60 requests/minute per IP.
+    Events come from the shared page cache or the local replica when it is
+    fresh (for sessions that may read update.webhook), with the cursor kept in the gateway's write-behind buffer and
+    persisted in batches, otherwise from Odoo in one call.
+    When the sync state predates the last compaction of the event log,
+    resync_required is true: reload everything, then continue from
+    next_sync_token. With include_data, each event carries the record's
+    fields for the app type (just the id for unlinks), fetched with one
+    batched read per model. Rate limited to 60 requests/minute per session.
     """
-    limiter: Limiter = _get_limiter(request)
-    key = get_remote_address(request)
-    if not limiter.hit("smart_sync_pull", key, limit=60, period=60):
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("smart_sync_pull", key, limit=60, period=60):
         raise HTTPException(status_code=429, detail="Too many requests, slow down.")
 
+    # الـ pull يحرّك الـ cursor: حالة الجهاز المخزنة لم تعد صالحة
+    cache.invalidate("sync_state", session_id)
+
     try:
-        # 1. Get or create sync state for this user/device
-        sync_state = client.call_kw(
-            "user.sync.state",
-            "get_or_create_state",
-            [sync_request.user_id, sync_request.device_id, sync_request.app_type]
-        )
+        # Filter by app type models (+ optional user filter), applied server-side
+        allowed_models = APP_TYPE_MODELS.get(sync_request.app_type, [])
 
-        last_event_id = sync_state.get("last_event_id", 0)
-        last_sync_time = sync_state.get("last_sync_time", "")
+        # 1. Event page from the shared cache or the local replica, else a
+        #    single Odoo round trip: state lookup, event fetch, cursor advance
+        #    and synced-by marking all happen in one Odoo transaction
+        result = None
+        if session.can_read_events:
+            result = await _pull_split(client, replica, pages, cursors, sync_request, allowed_models)
+        if result is None:
+            if cursors is not None:
+                # Odoo يقرأ الـ cursor بنفسه: نحفظ ما في الذاكرة أولًا
+                await cursors.settle(sync_request.user_id, sync_request.device_id)
+            result = await client.call_kw(
+                "user.sync.state",
+                "sync_pull",
+                [sync_request.user_id, sync_request.device_id, sync_request.app_type],
+                {
+                    "model_names": allowed_models,
+                    "models_filter": sync_request.models_filter or [],
+                    "limit": sync_request.limit,
+                },
+            )
+            if cursors is not None:
+                # الـ pull التالي يجد الـ cursor في الذاكرة
+                cursors.adopt(sync_request.user_id, sync_request.device_id, sync_request.app_type, result)
+            # بدون buffer لا يُقرأ الـ cache إلا مع replica: لا نملؤه بلا فائدة
+            if cursors is not None and session.can_read_events and result.get("events") and "from_event_id" in result:
+                pages.put(
+                    pages.key(allowed_models, sync_request.models_filter, result["from_event_id"], sync_request.limit),
+                    result["events"],
+                    result.get("settled_seq", 0),
+                )
 
-        # 2. Build domain for events
-        domain = [
-            ("id", ">", last_event_id),  # Only new events
-            ("is_archived", "=", False),  # Only active events
-        ]
+        events = result.get("events") or []
+        new_last_event_id = result.get("last_event_id", 0)
+        last_sync_time = result.get("last_sync_time") or ""
 
-        # Filter by app type models
-        allowed_models = APP_TYPE_MODELS.get(sync_request.app_type, [])
-        if allowed_models:
-            domain.append(("model", "in", allowed_models))
-
-        # Additional user filter
-        if sync_request.models_filter:
-            domain.append(("model", "in", sync_request.models_filter))
-
-        # 3. Fetch events
-        events = client.search_read(
-            "update.webhook",
-            domain=domain,
-            fields=["id", "model", "record_id", "event", "timestamp"],
-            limit=sync_request.limit,
-            order="id asc"  # Oldest first for proper sync
-        )
+        if result.get("resync_required"):
+            return SyncResponse(
+                has_updates=True,
+                new_events_count=0,
+                events=[],
+                next_sync_token=str(new_last_event_id),
+                last_sync_time=last_sync_time,
+                resync_required=True,
+            )
 
         if not events:
             return SyncResponse(
                 has_updates=False,
                 new_events_count=0,
                 events=[],
-                next_sync_token=str(last_event_id),
+                next_sync_token=str(new_last_event_id),
                 last_sync_time=last_sync_time
             )
 
-        # 4. Update user sync state
-        new_last_event_id = events[-1]["id"]
-
-        client.call_kw(
-            "user.sync.state",
-            "write",
-            [[sync_state["id"]], {
-                "last_event_id": new_last_event_id,
-                "last_sync_time": client.call_kw("ir.fields", "get_current_datetime", []),
-                "sync_count": sync_state.get("sync_count", 0) + 1
-            }]
-        )
-
-        # 5. Mark events as synced by this user
-        for event in events:
-            try:
-                client.call_kw(
-                    "update.webhook",
-                    "mark_as_synced_by_user",
-                    [[event["id"]]]
-                )
-            except Exception as e:
-                # Log but don't fail - non-critical
-                print(f"Warning: Could not mark event {event['id']} as synced: {e}")
+        # 2. Optional inline payloads, batched per model for the whole page
+        records: Dict[tuple, Dict[str, Any]] = {}
+        if sync_request.include_data:
+            records = await _fetch_event_data(client, sync_request.app_type, events)
 
-        # 6. Format response
+        # 3. Format response
         event_data = [
             EventData(
                 id=e["id"],
+                change_seq=e["change_seq"],
                 model=e.get("model", ""),
                 record_id=e.get("record_id", 0),
                 event=e.get("event", ""),
-                timestamp=e.get("timestamp", "")
+                timestamp=e.get("timestamp", ""),
+                data=(
+                    {"id": e["record_id"]} if e["event"] == "unlink"
+                    else records.get((e["model"], e["record_id"]))
+                ) if sync_request.include_data else None,
             )
             for e in events
         ]
@@ -201,66 +439,327 @@ def sync_pull(
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}") from e
 
 
-@router.get("/state", response_model=SyncStatsResponse)
-def get_sync_state(
+@router.get("/wait", response_model=SyncWaitResponse)
+async def sync_wait(
     request: Request,
-    user_id: int = Query(..., description="User ID"),
-    device_id: str = Query(..., description="Device ID"),
-    client: OdooClient = Depends(get_client),
+    since_token: str = Query(..., description="next_sync_token from the last pull"),
+    app_type: str = Query(..., description="App type: sales_app, delivery_app, manager_app, etc."),
+    models_filter: Optional[List[str]] = Query(None, description="Optional: filter by specific models"),
+    timeout: float = Query(SYNC_WAIT_DEFAULT_TIMEOUT, ge=0, le=SYNC_WAIT_MAX_TIMEOUT, description="Seconds to hold the request"),
+    session_id: str = Depends(get_session_id),
+    session: SessionInfo = Depends(get_session),
+    client: AsyncOdooClient = Depends(get_client),
+    feed: EventFeed = Depends(get_event_feed),
 ):
-    """Get current sync state for a user/device"""
-    limiter: Limiter = _get_limiter(request)
-    key = get_remote_address(request)
-    if not limiter.hit("sync_state", key, limit=30, period=60):
+    """
+    Long-poll: returns as soon as an event newer than since_token exists for
+    the device's models, or with has_updates=false after timeout. Parked
+    requests share one gateway-side watcher instead of each polling Odoo.
+    """
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("sync_wait", key, limit=60, period=60):
         raise HTTPException(status_code=429, detail="Too many requests, slow down.")
+    # الـ feed مشترك: لا يُجيب إلا من يملك قراءة update.webhook
+    if not session.can_read_events:
+        raise HTTPException(status_code=403, detail="No read access to update.webhook events.")
 
     try:
-        states = client.search_read(
-            "user.sync.state",
-            domain=[
-                ("user_id", "=", user_id),
-                ("device_id", "=", device_id)
-            ],
-            fields=["user_id", "device_id", "last_event_id", "last_sync_time", "sync_count", "is_active"],
-            limit=1
+        after_seq = int(since_token)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="INVALID_SYNC_TOKEN")
+
+    try:
+        has_updates = await feed.wait_for(
+            client,
+            session_id,
+            after_seq,
+            _resolve_models(app_type, models_filter),
+            timeout=timeout,
         )
+    except OdooError as e:
+        raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}") from e
 
-        if not states:
-            raise HTTPException(status_code=404, detail="Sync state not found")
+    return SyncWaitResponse(has_updates=has_updates, next_sync_token=since_token)
+
+
+def _sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+async def _stream_events(request: Request, feed: EventFeed, sub: FeedSubscription, session_id: str, after_seq: int):
+    try:
+        # توزيع إعادة الاتصال عشوائيًا لتفادي عاصفة reconnect
+        yield f"retry: {random.randint(2000, 10000)}\n\n"
+        if sub.needs_resync:
+            yield _sse("resync", {"next_sync_token": str(after_seq)})
+        while True:
+            try:
+                e = await asyncio.wait_for(sub.queue.get(), timeout=SSE_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": ping\n\n"
+                continue
+            yield _sse("update", e, event_id=e["change_seq"])
+            after_seq = e["change_seq"]
+            if sub.overflowed and sub.queue.empty():
+                # العميل بطيء: نغلق ونطلب منه سحب الفجوة عبر /pull
+                yield _sse("resync", {"next_sync_token": str(after_seq)})
+                return
+    finally:
+        feed.unsubscribe(sub, session_id)
+
+
+@router.get("/stream")
+async def sync_stream(
+    request: Request,
+    app_type: str = Query(..., description="App type: sales_app, delivery_app, manager_app, etc."),
+    since_token: Optional[str] = Query(None, description="next_sync_token to resume from"),
+    models_filter: Optional[List[str]] = Query(None, description="Optional: filter by specific models"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    session_id: str = Depends(get_session_id),
+    session: SessionInfo = Depends(get_session),
+    client: AsyncOdooClient = Depends(get_client),
+    feed: EventFeed = Depends(get_event_feed),
+):
+    """
+    Live Server-Sent Events stream of update.webhook events for an app type.
+    Events fan out from the shared feed, so subscribers never query Odoo.
+    On reconnect the browser's Last-Event-ID (or since_token) resumes from
+    the feed buffer; a `resync` event means: pull the gap via /pull first.
+    """
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("sync_stream", key, limit=30, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
+    # الأحداث تأتي من الـ feed المشترك لا من جلسة المشترك نفسه
+    if not session.can_read_events:
+        raise HTTPException(status_code=403, detail="No read access to update.webhook events.")
+
+    if feed.subscriber_count >= SSE_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many live subscribers, use /wait instead.")
+
+    token = last_event_id or since_token
+    try:
+        after_seq = int(token) if token else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="INVALID_SYNC_TOKEN")
 
-        state = states[0]
-        return SyncStatsResponse(
-            user_id=state.get("user_id")[0] if isinstance(state.get("user_id"), list) else state.get("user_id"),
-            device_id=state.get("device_id", ""),
-            last_event_id=state.get("last_event_id", 0),
-            last_sync_time=state.get("last_sync_time", ""),
-            sync_count=state.get("sync_count", 0),
-            is_active=state.get("is_active", False)
+    try:
+        await feed.prime(client)
+        # بدون token: نبدأ من الآن
+        if after_seq is None:
+            after_seq = feed.last_seq
+        sub = await feed.subscribe(
+            client,
+            session_id,
+            after_seq,
+            _resolve_models(app_type, models_filter),
+            queue_size=SSE_QUEUE_SIZE,
         )
+    except OdooError as e:
+        raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}") from e
 
-    except HTTPException:
-        raise
+    return StreamingResponse(
+        _stream_events(request, feed, sub, session_id, after_seq),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/cache-stats")
+async def event_page_cache_stats(
+    _session: SessionInfo = Depends(get_session),
+    pages: EventPageCache = Depends(get_event_page_cache),
+):
+    """Shared event page cache: size and hit/miss counters per app_type."""
+    return pages.stats()
+
+
+@router.post("/ack", response_model=AckResponse)
+async def ack_events(
+    request: Request,
+    ack: AckRequest,
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    client: AsyncOdooClient = Depends(get_client),
+):
+    """
+    Acknowledge events a device received out of order (e.g. from /stream)
+    without moving its cursor. Odoo keeps them as a small range set per
+    device next to the cursor, instead of one row per user and event.
+    Rate limited to 60 requests/minute per session.
+    """
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("sync_ack", key, limit=60, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
+
+    cache.invalidate("unsynced_devices", session_id)
+    try:
+        result = await client.call_kw(
+            "user.sync.state",
+            "ack_events",
+            [ack.user_id, ack.device_id, ack.app_type, ack.change_seqs],
+        )
+        return AckResponse(last_event_id=result["last_event_id"], acked_ranges=result.get("acked_ranges") or [])
     except OdooError as e:
         raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}") from e
 
 
+@router.get("/events/{event_id}/unsynced-devices", response_model=UnsyncedDevicesResponse)
+async def unsynced_devices(
+    request: Request,
+    event_id: int,
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    cursors: Optional[CursorBuffer] = Depends(get_cursor_buffer),
+    client: AsyncOdooClient = Depends(get_client),
+):
+    """
+    Active devices that have not synced event_id yet, answered from the
+    per-device cursors (watermarks) and ack ranges. Only devices whose app
+    type follows the event's model are listed; cursors still in the
+    gateway's write-behind buffer are taken into account. Sessions list
+    their own devices only, unless they are administrators or the gateway
+    service account.
+    """
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("unsynced_devices", key, limit=30, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
+
+    async def build():
+        try:
+            result = await client.call_kw("user.sync.state", "unsynced_devices", [event_id])
+        except OdooError as e:
+            raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Server error: {str(e)}") from e
+        if not result.get("found"):
+            raise HTTPException(status_code=404, detail="Event not found")
+
+        seq, model = result["change_seq"], result["model"]
+        devices = []
+        for d in result.get("devices") or []:
+            followed = APP_TYPE_MODELS.get(d["app_type"])
+            if followed and model not in followed:
+                continue
+            buffered = cursors.get(d["user_id"], d["device_id"]) if cursors is not None else None
+            if buffered is not None and buffered["last_event_id"] >= seq:
+                continue
+            devices.append(UnsyncedDevice(**d))
+        return seq, UnsyncedDevicesResponse(
+            event_id=result["event_id"],
+            change_seq=seq,
+            model=model,
+            count=len(devices),
+            devices=devices,
+        )
+
+    cache_key = cache.key("unsynced_devices", session_id, {"event_id": event_id})
+    return await respond_cached(request, cache, cache_key, build)
+
+
+@router.get("/state", response_model=SyncStatsResponse)
+async def get_sync_state(
+    request: Request,
+    user_id: int = Query(..., description="User ID"),
+    device_id: str = Query(..., description="Device ID"),
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    cursors: Optional[CursorBuffer] = Depends(get_cursor_buffer),
+    client: AsyncOdooClient = Depends(get_client),
+):
+    """Get current sync state for a user/device (short-TTL cache, If-None-Match → 304).
+    A cursor held in the write-behind buffer is served from memory: it is
+    newer than Odoo's copy until the next flush."""
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("sync_state", key, limit=30, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
+
+    async def build():
+        buffered = cursors.get(user_id, device_id) if cursors is not None else None
+        if buffered is not None:
+            return buffered["last_event_id"], SyncStatsResponse(
+                user_id=user_id,
+                device_id=device_id,
+                last_event_id=buffered["last_event_id"],
+                last_sync_time=buffered["last_sync_time"],
+                sync_count=buffered["sync_count"],
+                is_active=buffered["is_active"],
+            )
+        try:
+            states = await client.search_read(
+                "user.sync.state",
+                domain=[
+                    ("user_id", "=", user_id),
+                    ("device_id", "=", device_id)
+                ],
+                fields=["user_id", "device_id", "last_event_id", "last_sync_time", "sync_count", "is_active"],
+                limit=1
+            )
+
+            if not states:
+                raise HTTPException(status_code=404, detail="Sync state not found")
+
+            state = states[0]
+            last_event_id = state.get("last_event_id", 0)
+            return last_event_id, SyncStatsResponse(
+                user_id=state.get("user_id")[0] if isinstance(state.get("user_id"), list) else state.get("user_id"),
+                device_id=state.get("device_id", ""),
+                last_event_id=last_event_id,
+                last_sync_time=state.get("last_sync_time", ""),
+                sync_count=state.get("sync_count", 0),
+                is_active=state.get("is_active", False)
+            )
+
+        except HTTPException:
+            raise
+        except OdooError as e:
+            raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Server error: {str(e)}") from e
+
+    cache_key = cache.key("sync_state", session_id, {"user_id": user_id, "device_id": device_id})
+    return await respond_cached(request, cache, cache_key, build)
+
+
 @router.post("/reset")
-def reset_sync_state(
+async def reset_sync_state(
     request: Request,
     user_id: int = Query(..., description="User ID"),
     device_id: str = Query(..., description="Device ID"),
-    client: OdooClient = Depends(get_client),
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    cursors: Optional[CursorBuffer] = Depends(get_cursor_buffer),
+    client: AsyncOdooClient = Depends(get_client),
 ):
     """Reset sync state for a user/device (useful for troubleshooting)"""
-    limiter: Limiter = _get_limiter(request)
-    key = get_remote_address(request)
-    if not limiter.hit("sync_reset", key, limit=5, period=60):
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("sync_reset", key, limit=5, period=60):
         raise HTTPException(status_code=429, detail="Too many requests, slow down.")
 
+    cache.invalidate("sync_state", session_id)
+    if cursors is not None:
+        # التقدّم غير المحفوظ يُلغى؛ flush جارٍ سيفشل في الـ compare-and-set
+        cursors.drop(user_id, device_id)
+
     try:
-        states = client.search(
+        states = await client.search(
             "user.sync.state",
             domain=[
                 ("user_id", "=", user_id),
@@ -271,9 +770,10 @@ def reset_sync_state(
         if not states:
             raise HTTPException(status_code=404, detail="Sync state not found")
 
-        client.write("user.sync.state", states, {
+        await client.write("user.sync.state", states, {
             "last_event_id": 0,
-            "sync_count": 0
+            "sync_count": 0,
+            "acked_ranges": False,
         })
 
         return {"status": "success", "message": "Sync state reset successfully"}
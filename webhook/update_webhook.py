@@ -1,19 +1,29 @@
 # webhook/update_webhook.py
 from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional
+from typing import AsyncIterator, Optional
 from starlette.requests import Request
+import httpx
 
-from core.auth import get_session_id
-from clients.odoo_client import OdooClient, OdooError
+from core.auth import SessionInfo, get_session, get_session_id
+from core.transport import get_odoo_transport
+from core.singleflight import SingleFlight, get_singleflight
+from core.jobs import JobRegistry, get_job_registry
+from core.cache import EventPageCache, ResponseCache, get_event_page_cache, get_response_cache, respond_cached
+from core.event_feed import EventFeed, get_event_feed
+from core.replica import EventReplica, get_replica
+from clients.odoo_client import AsyncOdooClient, OdooError
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from config import ODOO_URL  # تأكد من وجوده في config.py
 
-# Rate limiting
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+# Rate limiting (shared across workers, keyed by session)
+from core.ratelimit import RateLimiter, get_rate_limiter, rate_limit_key
 
 router = APIRouter(prefix="/api/v1", tags=["updates"])
 
+# كل استدعاء RPC يحذف على الأكثر batch_size * CLEANUP_MAX_BATCHES_PER_CALL سطرًا
+CLEANUP_MAX_BATCHES_PER_CALL = 10
+
 # ===== Schemas =====
 class ModelCount(BaseModel):
     model: str
@@ -25,70 +35,185 @@ class CheckUpdatesOut(BaseModel):
     summary: list[ModelCount]
 
 # ===== Dependencies =====
-def get_client(session_id: str = Depends(get_session_id)) -> OdooClient:
-    return OdooClient(
+async def get_client(
+    session: SessionInfo = Depends(get_session),
+    transport: httpx.AsyncHTTPTransport = Depends(get_odoo_transport),
+    singleflight: SingleFlight = Depends(get_singleflight),
+) -> AsyncIterator[AsyncOdooClient]:
+    # كل طلب يحمل session cookie خاص به فوق نفس الـ pool المشترك؛ الجلسة مُتحقق منها مسبقًا
+    client = AsyncOdooClient(
         base_url=ODOO_URL,
-        session_id=session_id,
+        session_id=session.session_id,
         timeout=15,
         retries=2,
         backoff=0.3,
         user_agent="WebhookServer/1.0",
+        transport=transport,
+        coalescer=singleflight,
+        coalesce_scope=session.scope,
     )
-
-def _get_limiter(request: Request) -> Limiter:
-    # نأخذ ال-limiter المُسجل في app.state (مُهيّأ في main.py)
-    return request.app.state.limiter
+    try:
+        yield client
+    finally:
+        await client.aclose()
 
 # ===== Routes =====
 @router.get("/check-updates", response_model=CheckUpdatesOut)
-def check_updates(
+async def check_updates(
     request: Request,  # ضروري لالتقاط IP من أجل التحديد
     since: Optional[str] = Query(None, description="ISO datetime: return updates >= since"),
-    limit: int = Query(200, ge=1, le=1000),
-    client: OdooClient = Depends(get_client),
+    limit: int = Query(200, ge=1, le=1000, deprecated=True, description="Ignored: counts are no longer truncated"),
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    feed: EventFeed = Depends(get_event_feed),
+    replica: Optional[EventReplica] = Depends(get_replica),
+    session: SessionInfo = Depends(get_session),
+    client: AsyncOdooClient = Depends(get_client),
 ):
     """
     Returns a lightweight summary of update.webhook since a timestamp (optional).
-    Rate limited to 10 requests/minute per IP.
+    Counts are aggregated over every row, by the local replica when it is
+    fresh and the session may read update.webhook, by Odoo (read_group)
+    otherwise.
+    Answers from a short-TTL cache and honours If-None-Match (304).
+    Rate limited to 10 requests/minute per session.
     """
-    # Rate limiting handled by SlowAPIMiddleware in main.py
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("check_updates", key, limit=10, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
 
-    try:
-        data = client.get_updates_summary(limit=limit, since=since)
-    except OdooError as e:
-        raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server error: {e}") from e
+    async def build():
+        try:
+            if replica is not None and session.can_read_events and await replica.is_fresh():
+                data = await replica.count_by_model(since)
+            else:
+                data = await client.count_updates_by_model(since=since)
+        except OdooError as e:
+            raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Server error: {e}") from e
 
-    last_at = data.get("last_update_at")
-    summary = [ModelCount(**s) for s in data.get("summary", [])]
-    return CheckUpdatesOut(
-        has_update=bool(summary),
-        last_update_at=last_at,
-        summary=summary
-    )
+        last_at = data.get("last_update_at")
+        summary = [ModelCount(**s) for s in data.get("summary", [])]
+        return last_at, CheckUpdatesOut(
+            has_update=bool(summary),
+            last_update_at=last_at,
+            summary=summary
+        )
+
+    key = cache.key("check_updates", session_id, {"since": since})
+    return await respond_cached(request, cache, key, build, version=feed.last_seq)
+
+async def _run_cleanup(
+    client: AsyncOdooClient,
+    before: Optional[str],
+    batch_size: int,
+    progress: dict,
+    replica: Optional[EventReplica] = None,
+    all_events: bool = False,
+) -> dict:
+    """Repeat bounded server-side deletes until Odoo reports done, then mirror them on the replica."""
+    progress.update({"deleted": 0, "calls": 0, "done": False})
+    while True:
+        chunk = await client.cleanup_updates_chunk(
+            before=before,
+            all_events=all_events,
+            batch_size=batch_size,
+            max_batches=CLEANUP_MAX_BATCHES_PER_CALL,
+        )
+        progress["deleted"] += int(chunk.get("deleted", 0))
+        progress["calls"] += 1
+        if chunk.get("done"):
+            if replica is not None:
+                await replica.prune(before)
+            progress["done"] = True
+            return dict(progress)
 
 @router.delete("/cleanup")
-def cleanup_updates(
+async def cleanup_updates(
     request: Request,
     before: Optional[str] = Query(None, description="Delete events occurred_at <= before (ISO datetime)"),
-    client: OdooClient = Depends(get_client),
+    all_events: bool = Query(False, alias="all", description="Delete every event (only without before); devices must fully resync"),
+    batch_size: int = Query(1000, ge=100, le=10000, description="Rows deleted per server-side batch"),
+    background: bool = Query(False, description="Run as a background job and return a status URL"),
+    session_id: str = Depends(get_session_id),
+    transport: httpx.AsyncHTTPTransport = Depends(get_odoo_transport),
+    jobs: JobRegistry = Depends(get_job_registry),
+    cache: ResponseCache = Depends(get_response_cache),
+    pages: EventPageCache = Depends(get_event_page_cache),
+    replica: Optional[EventReplica] = Depends(get_replica),
+    client: AsyncOdooClient = Depends(get_client),
 ):
     """
     Cleanup update.webhook rows older than a given ISO timestamp.
-    Rate limited to 5 requests/minute per IP.
+    Odoo deletes in fixed-size batches and every RPC is bounded, so a large
+    cleanup no longer hits the client timeout half-way through.
+    Either before or all=true is required: a bare DELETE /cleanup is
+    refused instead of emptying the log.
+    Rate limited to 5 requests/minute per session.
     """
-    # Rate limiting handled by SlowAPIMiddleware in main.py
+    if not before and not all_events:
+        raise HTTPException(status_code=400, detail="MISSING_BEFORE: pass before=<ISO datetime>, or all=true to delete every event")
+    if before and all_events:
+        raise HTTPException(status_code=400, detail="CONFLICTING_PARAMS: before and all=true are mutually exclusive")
+
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("cleanup", key, limit=5, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
+
+    # القراءات المخزنة لهذه الجلسة لم تعد صالحة
+    cache.invalidate("check_updates", session_id)
+    cache.invalidate("events", session_id)
+    pages.clear()
+
+    if background:
+        # عميل مستقل لأن المهمة تعيش بعد انتهاء الطلب
+        job_client = AsyncOdooClient(
+            base_url=ODOO_URL,
+            session_id=session_id,
+            timeout=15,
+            retries=2,
+            backoff=0.3,
+            user_agent="WebhookServer/1.0",
+            transport=transport,
+        )
+        job = jobs.start(
+            "cleanup",
+            session_id,
+            lambda progress: _run_cleanup(job_client, before, batch_size, progress, replica, all_events),
+        )
+        return JSONResponse(
+            status_code=202,
+            content={
+                "ok": True,
+                "job_id": job["job_id"],
+                "status_url": str(request.url_for("cleanup_job_status", job_id=job["job_id"])),
+            },
+        )
 
     try:
-        deleted = client.cleanup_updates(before=before)
+        result = await _run_cleanup(client, before, batch_size, {}, replica, all_events)
     except OdooError as e:
         raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {e}") from e
 
-    return {"ok": True, "deleted": deleted}
+    return {"ok": True, "deleted": result["deleted"], "calls": result["calls"]}
+
+@router.get("/cleanup/jobs/{job_id}", name="cleanup_job_status")
+async def cleanup_job_status(
+    job_id: str,
+    session_id: str = Depends(get_session_id),
+    jobs: JobRegistry = Depends(get_job_registry),
+):
+    """Progress of a background cleanup started with background=true."""
+    job = jobs.get(job_id, session_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
@@ -1,16 +1,24 @@
 # webhook/webhook.py
+import base64
+import json
+
 from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional, Literal
+from typing import AsyncIterator, Optional, Literal
 from starlette.requests import Request
+import httpx
 
-from core.auth import get_session_id
-from clients.odoo_client import OdooClient, OdooError
+from core.auth import SessionInfo, get_session, get_session_id
+from core.transport import get_odoo_transport
+from core.singleflight import SingleFlight, get_singleflight
+from core.cache import ResponseCache, get_response_cache, respond_cached
+from core.event_feed import EventFeed, get_event_feed
+from core.replica import EventReplica, get_replica
+from clients.odoo_client import AsyncOdooClient, OdooError
 from pydantic import BaseModel
 from config import ODOO_URL
 
-# Rate limiting
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+# Rate limiting (shared across workers, keyed by session)
+from core.ratelimit import RateLimiter, get_rate_limiter, rate_limit_key
 
 router = APIRouter(prefix="/api/v1/webhook", tags=["webhook"])
 
@@ -26,24 +34,49 @@ class EventsResponse(BaseModel):
     status: str = "success"
     count: int
     data: list[WebhookEventOut]
+    next_cursor: Optional[str] = None  # مرّره كـ cursor لجلب الصفحة التالية
+
+# ===== Keyset cursor =====
+def _encode_cursor(timestamp: str, event_id: int) -> str:
+    raw = json.dumps([timestamp, event_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, event_id = json.loads(raw)
+        if not isinstance(timestamp, str) or not isinstance(event_id, int):
+            raise ValueError("bad cursor payload")
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="INVALID_CURSOR") from e
+    return timestamp, event_id
 
 # ===== Dependencies =====
-def get_client(session_id: str = Depends(get_session_id)) -> OdooClient:
-    return OdooClient(
+async def get_client(
+    session: SessionInfo = Depends(get_session),
+    transport: httpx.AsyncHTTPTransport = Depends(get_odoo_transport),
+    singleflight: SingleFlight = Depends(get_singleflight),
+) -> AsyncIterator[AsyncOdooClient]:
+    # كل طلب يحمل session cookie خاص به فوق نفس الـ pool المشترك؛ الجلسة مُتحقق منها مسبقًا
+    client = AsyncOdooClient(
         base_url=ODOO_URL,
-        session_id=session_id,
+        session_id=session.session_id,
         timeout=15,
         retries=2,
         backoff=0.3,
         user_agent="WebhookServer/1.0",
+        transport=transport,
+        coalescer=singleflight,
+        coalesce_scope=session.scope,
     )
+    try:
+        yield client
+    finally:
+        await client.aclose()
 
 # ===== Routes =====
-def _get_limiter(request: Request) -> Limiter:
-    return request.app.state.limiter
-
 @router.get("/events", response_model=EventsResponse)
-def list_events(
+async def list_events(
     request: Request,
     model_name: Optional[str] = Query(None, description="Filter by model name"),
     record_id: Optional[int] = Query(None, description="Filter by specific record id"),
@@ -51,16 +84,31 @@ def list_events(
     since: Optional[str] = Query(None, description="ISO datetime to filter timestamp >= since"),
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
-    client: OdooClient = Depends(get_client),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor from the previous page (replaces offset)"),
+    session_id: str = Depends(get_session_id),
+    cache: ResponseCache = Depends(get_response_cache),
+    feed: EventFeed = Depends(get_event_feed),
+    replica: Optional[EventReplica] = Depends(get_replica),
+    session: SessionInfo = Depends(get_session),
+    client: AsyncOdooClient = Depends(get_client),
 ):
     """
     List raw events from update.webhook with useful filters.
-    Rate limited to 30 requests/minute per IP.
+    Pages by keyset on (timestamp, id) when `cursor` is given, so deep pages
+    stay an index range scan and don't shift while new events arrive.
+    Served from the local replica when it is fresh and the session may read
+    update.webhook, from Odoo otherwise; archived events are left out on
+    both paths.
+    Answers from a short-TTL cache and honours If-None-Match (304).
+    Rate limited to 30 requests/minute per session.
     """
-    # Rate limiting handled by SlowAPIMiddleware in main.py
+    limiter: RateLimiter = get_rate_limiter(request)
+    key = rate_limit_key(request)
+    if not await limiter.hit("webhook_events", key, limit=30, period=60):
+        raise HTTPException(status_code=429, detail="Too many requests, slow down.")
 
-    # Build domain
-    domain = []
+    # Build domain: الأحداث الحيّة فقط، مثل الـ replica
+    domain = [["is_archived", "=", False]]
     if model_name:
         domain.append(["model", "=", model_name])
     if record_id is not None:
@@ -69,30 +117,72 @@ def list_events(
         domain.append(["event", "=", event])
     if since:
         domain.append(["timestamp", ">=", since])  # ✅ استبدلنا occurred_at بـ timestamp
+    before = None
+    if cursor:
+        if offset:
+            raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+        # (timestamp, id) < (ts, id) بترتيب تنازلي
+        cursor_ts, cursor_id = _decode_cursor(cursor)
+        before = (cursor_ts, cursor_id)
+        domain += [
+            "|",
+            ["timestamp", "<", cursor_ts],
+            "&", ["timestamp", "=", cursor_ts], ["id", "<", cursor_id],
+        ]
 
-    try:
-        rows = client.search_read(
-            "update.webhook",
-            domain=domain,
-            fields=["id", "model", "record_id", "event", "timestamp"],  # ✅ استبدال
-            limit=limit,
-            offset=offset,
-            order="timestamp desc",  # ✅ استبدال
-        )
-    except OdooError as e:
-        raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server error: {e}") from e
+    async def build():
+        try:
+            if replica is not None and session.can_read_events and await replica.is_fresh():
+                rows = await replica.list_events(
+                    model_name=model_name,
+                    record_id=record_id,
+                    event=event,
+                    since=since,
+                    before=before,
+                    limit=limit,
+                    offset=offset,
+                )
+            else:
+                rows = await client.search_read(
+                    "update.webhook",
+                    domain=domain,
+                    fields=["id", "model", "record_id", "event", "timestamp"],  # ✅ استبدال
+                    limit=limit,
+                    offset=offset,
+                    order="timestamp desc, id desc",  # ✅ استبدال (id يضمن ترتيبًا ثابتًا)
+                )
+        except OdooError as e:
+            raise HTTPException(status_code=502, detail=f"Odoo error: {e}") from e
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Server error: {e}") from e
+
+        # ✅ نعرض timestamp لكن تحت اسم occurred_at
+        data = [
+            WebhookEventOut(
+                id=r["id"],
+                model=r.get("model", ""),
+                record_id=r.get("record_id", 0),
+                event=r.get("event", "manual"),
+                occurred_at=r.get("timestamp", ""),
+            )
+            for r in rows
+        ]
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = _encode_cursor(last.get("timestamp", ""), last["id"])
+        # أعلى id في الصفحة هو مُعرّف نسختها
+        marker = max((r["id"] for r in rows), default=0)
+        return marker, EventsResponse(count=len(data), data=data, next_cursor=next_cursor)
 
-    # ✅ نعرض timestamp لكن تحت اسم occurred_at
-    data = [
-        WebhookEventOut(
-            id=r["id"],
-            model=r.get("model", ""),
-            record_id=r.get("record_id", 0),
-            event=r.get("event", "manual"),
-            occurred_at=r.get("timestamp", ""),
-        )
-        for r in rows
-    ]
-    return EventsResponse(count=len(data), data=data)
+    params = {
+        "model_name": model_name,
+        "record_id": record_id,
+        "event": event,
+        "since": since,
+        "limit": limit,
+        "offset": offset,
+        "cursor": cursor,
+    }
+    key = cache.key("events", session_id, params)
+    return await respond_cached(request, cache, key, build, version=feed.last_seq)